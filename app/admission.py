@@ -0,0 +1,168 @@
+"""Admission control: shed load early instead of letting every request degrade.
+
+The controller watches requests in flight, saturation of the database
+connection pools and event-loop lag. When a threshold is crossed, low
+priority requests are answered right away with 503 and `Retry-After`
+instead of queueing for a connection until clients time out. Past the hard
+in-flight limit every request is shed. Health endpoints are never shed and
+never touch the database.
+"""
+
+import asyncio
+import logging
+import re
+from collections.abc import Callable
+
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import QueuePool
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.config import settings
+from app.database import shards
+
+logger = logging.getLogger(__name__)
+
+# paths answered regardless of load
+EXEMPT_PATHS = {"/", "/healthz", "/readyz"}
+
+# routes clients can retry later without anyone noticing: feeds, digests,
+# searches, stats
+LOW_PRIORITY = re.compile(
+    r"(/users/[^/]+/(birthdays\.ics|digest|persons/search|stats)|/stats/?)$"
+)
+
+# long-lived event streams: admitted like low priority routes, but once
+# admitted they are not requests in flight
+STREAMING = re.compile(r"/events/?$")
+
+
+def pool_saturation(engine: AsyncEngine, max_overflow: int) -> float:
+    """Share of the engine's connections checked out.
+
+    At 1.0 the pool is saturated: every pooled and overflow connection is in
+    use, so the next checkout waits for one to be returned. `max_overflow` is
+    the one the engine was created with, queue pools don't expose it.
+    """
+    pool = engine.sync_engine.pool
+    # only queue pools have a bounded number of connections
+    if not isinstance(pool, QueuePool) or max_overflow < 0:
+        return 0.0
+    capacity = pool.size() + max_overflow
+    return pool.checkedout() / capacity if capacity > 0 else 0.0
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_in_flight: int = 256,
+        max_loop_lag: float = 0.2,
+        max_pool_saturation: float = 1.0,
+        retry_after: int = 1,
+        engines: Callable[[], list[AsyncEngine]] = lambda: shards.engines,
+        max_overflow: int = settings.database_max_overflow,
+        lag_interval: float = 0.1,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_loop_lag = max_loop_lag
+        self.max_pool_saturation = max_pool_saturation
+        self.retry_after = retry_after
+        self.engines = engines
+        self.max_overflow = max_overflow
+        self.lag_interval = lag_interval
+        self.in_flight = 0
+        self.loop_lag = 0.0
+        self.shed = 0
+
+    @classmethod
+    def from_settings(cls) -> "AdmissionController":
+        return cls(
+            max_in_flight=settings.admission_max_in_flight,
+            max_loop_lag=settings.admission_max_loop_lag_ms / 1000,
+            max_pool_saturation=settings.admission_max_pool_saturation,
+            retry_after=settings.admission_retry_after,
+        )
+
+    def pool_saturation(self) -> float:
+        return max(
+            (pool_saturation(engine, self.max_overflow) for engine in self.engines()),
+            default=0.0,
+        )
+
+    def overload(self) -> str | None:
+        """Why the service is overloaded, or None if it isn't."""
+        if self.in_flight >= self.max_in_flight:
+            return "too many requests in flight"
+        if self.loop_lag > self.max_loop_lag:
+            return f"event loop lagging {self.loop_lag * 1000:.0f}ms"
+        if self.pool_saturation() >= self.max_pool_saturation:
+            return "database pool saturated"
+        return None
+
+    def shed_reason(self, path: str) -> str | None:
+        """Why a request to `path` must be shed, or None to admit it."""
+        if path in EXEMPT_PATHS:
+            return None
+        # everything gets shed past twice the in-flight limit
+        if self.in_flight >= 2 * self.max_in_flight:
+            return "too many requests in flight"
+        if LOW_PRIORITY.search(path) or STREAMING.match(path):
+            return self.overload()
+        return None
+
+    async def monitor_loop_lag(self) -> None:
+        """Measure how late the event loop wakes up from short sleeps."""
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, loop.time() - start - self.lag_interval)
+            # smooth spikes a little, but keep reacting within a few intervals
+            self.loop_lag = 0.5 * self.loop_lag + 0.5 * lag
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "loop_lag_ms": round(self.loop_lag * 1000, 1),
+            "pool_saturation": round(self.pool_saturation(), 2),
+            "shed": self.shed,
+            "overload": self.overload(),
+        }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware admitting or shedding requests through a controller."""
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        reason = self.controller.shed_reason(scope["path"])
+        if reason is not None:
+            self.controller.shed += 1
+            logger.warning(f"Shedding {scope['method']} {scope['path']}: {reason}")
+            response = JSONResponse(
+                {"detail": "Service overloaded, retry later"},
+                status_code=503,
+                headers={"Retry-After": str(self.controller.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        if STREAMING.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        self.controller.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.in_flight -= 1
+
+
+admission = AdmissionController.from_settings()
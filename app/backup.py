@@ -0,0 +1,199 @@
+"""Online backups of the SQLite databases.
+
+Snapshots are taken with SQLite's online backup API, a few pages at a time,
+inside a single read transaction. The databases run in WAL mode, so that
+transaction pins a consistent snapshot without blocking writers, and writes
+from other connections don't restart the copy. The copy runs in a worker
+thread so the event loop is never blocked. Snapshots are gzip-compressed and
+only the newest `keep` are retained.
+
+    python -m app.backup create
+    python -m app.backup list
+    python -m app.backup restore backups/database-1a2b3c4d-20261019T000000000000Z.db.gz
+"""
+
+import argparse
+import asyncio
+import gzip
+import hashlib
+import logging
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import UTC, datetime
+from pathlib import Path
+
+from sqlalchemy.engine import make_url
+
+from app.config import settings
+from app.database import SHARD_URLS
+
+logger = logging.getLogger(__name__)
+
+# pages copied per step (4 MiB with the default page size) and pause in between
+PAGES_PER_STEP = 1024
+STEP_PAUSE = 0.005
+
+
+def sqlite_path(url: str) -> Path | None:
+    """Path of the database file of a SQLite URL, None for other or in-memory DBs."""
+    parsed = make_url(url)
+    if not parsed.drivername.startswith("sqlite"):
+        return None
+    if parsed.database in (None, "", ":memory:"):
+        return None
+    return Path(parsed.database)
+
+
+def _snapshot(source: Path, destination: Path, pages: int, pause: float) -> None:
+    def progress(status: int, remaining: int, total: int) -> None:
+        # spread the reads out a little instead of saturating the disk
+        time.sleep(pause)
+
+    with tempfile.TemporaryDirectory(dir=destination.parent) as tmp:
+        copy = Path(tmp) / source.name
+        src = sqlite3.connect(source, isolation_level=None)
+        dst = sqlite3.connect(copy)
+        try:
+            # without an open read transaction every write to the source by
+            # another connection restarts the backup, which then never ends
+            # under steady writes; in WAL mode holding one blocks no writer
+            src.execute("BEGIN")
+            src.execute("SELECT count(*) FROM sqlite_master").fetchall()
+            src.backup(dst, pages=pages, progress=progress)
+            src.execute("COMMIT")
+        finally:
+            dst.close()
+            src.close()
+
+        partial = Path(tmp) / destination.name
+        with (
+            copy.open("rb") as f_in,
+            gzip.open(partial, "wb", compresslevel=6) as f_out,
+        ):
+            shutil.copyfileobj(f_in, f_out, length=1024 * 1024)
+        partial.replace(destination)
+
+
+def _prefix(source: Path) -> str:
+    # a hash of the path, so shards with the same file name in different
+    # directories don't share their snapshots
+    digest = hashlib.sha1(str(source.resolve()).encode()).hexdigest()[:8]
+    return f"{source.stem}-{digest}"
+
+
+def _snapshot_name(source: Path) -> re.Pattern:
+    """Names of the snapshots of `source`, e.g. `shard-1a2b3c4d-<time>.db.gz`."""
+    return re.compile(rf"{re.escape(_prefix(source))}-\d{{8}}T\d{{12}}Z\.db\.gz")
+
+
+def snapshots(backup_dir: Path, source: Path) -> list[Path]:
+    """Snapshots of `source` in `backup_dir`, oldest first."""
+    name = _snapshot_name(source)
+    return sorted(
+        path for path in backup_dir.glob("*.db.gz") if name.fullmatch(path.name)
+    )
+
+
+async def backup_database(
+    source: Path,
+    backup_dir: Path,
+    keep: int = 7,
+    pages: int = PAGES_PER_STEP,
+    pause: float = STEP_PAUSE,
+) -> Path:
+    """Write a compressed snapshot of `source` and prune old ones."""
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now(UTC).strftime("%Y%m%dT%H%M%S%fZ")
+    destination = backup_dir / f"{_prefix(source)}-{stamp}.db.gz"
+
+    logger.info(f"Backing up {source} to {destination} ...")
+    started = time.monotonic()
+    await asyncio.to_thread(_snapshot, source, destination, pages, pause)
+    logger.info(f"Backed up {source} in {time.monotonic() - started:.1f}s")
+
+    for old in snapshots(backup_dir, source)[:-keep]:
+        logger.info(f"Removing old backup {old}")
+        old.unlink()
+    return destination
+
+
+def restore_backup(archive: Path, target: Path) -> None:
+    """Replace the content of the `target` database with a snapshot.
+
+    Goes through the backup API too, so the target stays a valid database at
+    every point. Stop the API first: connections open during the restore
+    keep running, but see the data change under them.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = Path(tmp) / "restore.db"
+        with gzip.open(archive, "rb") as f_in, copy.open("wb") as f_out:
+            shutil.copyfileobj(f_in, f_out, length=1024 * 1024)
+
+        src = sqlite3.connect(copy)
+        dst = sqlite3.connect(target)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+    logger.info(f"Restored {target} from {archive}")
+
+
+def backup_sources() -> list[Path]:
+    return [path for url in SHARD_URLS if (path := sqlite_path(url))]
+
+
+async def backup_all(backup_dir: Path, keep: int) -> list[Path]:
+    """Snapshot every SQLite shard, one after the other."""
+    return [
+        await backup_database(source, backup_dir, keep) for source in backup_sources()
+    ]
+
+
+async def run_backups(backup_dir: Path, interval: float, keep: int) -> None:
+    """Snapshot every SQLite shard each `interval` seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await backup_all(backup_dir, keep)
+        except Exception as e:
+            logger.error(f"Backup failed: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Back up and restore SQLite databases")
+    parser.add_argument("--dir", default=settings.backup_dir or "backups", type=Path)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("create", help="snapshot every SQLite database now")
+    commands.add_parser("list", help="list the snapshots of every SQLite database")
+    restore = commands.add_parser("restore", help="restore a database from a snapshot")
+    restore.add_argument("archive", type=Path)
+    restore.add_argument(
+        "--database",
+        type=Path,
+        help="database file to restore into (default: the one the snapshot was taken of)",
+    )
+    args = parser.parse_args()
+
+    if args.command == "create":
+        for path in asyncio.run(backup_all(args.dir, settings.backup_keep)):
+            print(path)
+    elif args.command == "list":
+        for source in backup_sources():
+            for path in snapshots(args.dir, source):
+                print(path)
+    else:
+        target = args.database
+        if target is None:
+            matches = [
+                source
+                for source in backup_sources()
+                if _snapshot_name(source).fullmatch(args.archive.name)
+            ]
+            if len(matches) != 1:
+                parser.error("cannot tell which database to restore, pass --database")
+            target = matches[0]
+        restore_backup(args.archive, target)
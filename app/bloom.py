@@ -0,0 +1,111 @@
+"""In-memory Bloom filter of registered telegram_ids.
+
+Answers "definitely not registered" without touching the database, so only
+"probably registered" ids need a lookup to confirm.
+"""
+
+import hashlib
+import logging
+import math
+
+from sqlalchemy import select
+
+from app.config import settings
+from app.database import Shards
+from app.models import User
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Bloom filter over integer keys, sized for `capacity` keys at `error_rate`."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError("capacity must be positive and error_rate in (0, 1)")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(
+            8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: int) -> list[int]:
+        # double hashing: two independent 64-bit hashes generate all k positions
+        digest = hashlib.blake2b(
+            key.to_bytes(8, "big", signed=True), digest_size=16
+        ).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, key: int) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: int) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+    def false_positive_rate(self) -> float:
+        """Expected false positive rate with the keys added so far."""
+        return (
+            1 - math.exp(-self.hash_count * self.count / self.size)
+        ) ** self.hash_count
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "items": self.count,
+            "size_bytes": len(self._bits),
+            "hash_count": self.hash_count,
+            "target_error_rate": self.error_rate,
+            "estimated_error_rate": self.false_positive_rate(),
+        }
+
+
+class RegistrationFilter:
+    """Bloom filter of registered telegram_ids, loaded from the `user` table.
+
+    Until it is loaded, every id is reported as possibly registered.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.filter = BloomFilter(capacity, error_rate)
+        self.ready = False
+
+    async def load(self, shards: Shards) -> None:
+        async def load_shard(session) -> None:
+            result = await session.stream_scalars(
+                select(User.telegram_id).execution_options(yield_per=10_000)
+            )
+            async for telegram_id in result:
+                self.filter.add(telegram_id)
+
+        await shards.fan_out(load_shard)
+        self.ready = True
+        if self.filter.count > self.filter.capacity:
+            logger.warning(
+                "Registration filter is over capacity, raise BLOOM_CAPACITY to keep "
+                "its false positive rate down"
+            )
+        logger.info(f"Registration filter loaded: {self.filter.stats()}")
+
+    def might_exist(self, telegram_id: int) -> bool:
+        return not self.ready or telegram_id in self.filter
+
+    def add(self, telegram_id: int) -> None:
+        self.filter.add(telegram_id)
+
+    def stats(self) -> dict:
+        return {"ready": self.ready, **self.filter.stats()}
+
+
+registered_users = RegistrationFilter(
+    settings.bloom_capacity, settings.bloom_error_rate
+)
@@ -0,0 +1,64 @@
+"""Helpers for HTTP conditional requests (ETag and Last-Modified validators)."""
+
+from datetime import UTC, datetime, timedelta
+from email.utils import format_datetime, parsedate_to_datetime
+
+
+def _as_utc(dt: datetime) -> datetime:
+    # naive datetimes coming from the database are stored in UTC
+    return dt.replace(tzinfo=UTC) if dt.tzinfo is None else dt.astimezone(UTC)
+
+
+def http_date(dt: datetime) -> str:
+    """Format a datetime as an HTTP-date, e.g. `Mon, 19 Oct 2026 10:00:00 GMT`."""
+    return format_datetime(_as_utc(dt).replace(microsecond=0), usegmt=True)
+
+
+def last_modified(modified: datetime, now: datetime | None = None) -> datetime:
+    """The `Last-Modified` time to advertise for a resource modified at `modified`.
+
+    HTTP-dates have one second resolution. Once the second of the modification
+    is over, its end is advertised: later writes come after it, and unchanged
+    resources compare as not modified. Until then its start is advertised,
+    which never compares as not modified, or a write later in the same second
+    would go unnoticed.
+    """
+    modified = _as_utc(modified)
+    second = modified.replace(microsecond=0)
+    end = second + timedelta(seconds=1)
+    if modified == second or end > (now or datetime.now(UTC)):
+        return second
+    return end
+
+
+def etag_matches(header: str | None, etag: str, weak: bool = True) -> bool:
+    """Check an `If-None-Match`/`If-Match` header against the current ETag.
+
+    `If-None-Match` uses the weak comparison (the default); `If-Match` must
+    use the strong one, where weak validators never match.
+    """
+    if header is None:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified_since(header: str | None, last_modified: datetime) -> bool:
+    """Check an `If-Modified-Since` header against the resource modification time."""
+    if header is None:
+        return False
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    # untruncated: a resource modified within the second named is modified
+    return _as_utc(last_modified) <= _as_utc(since)
@@ -21,6 +21,106 @@ class Settings(BaseSettings):
         description="Logging level: DEBUG, INFO, WARNING, ERROR, CRITICAL",
     )
     database_url: str = Field(default="sqlite://")
+    database_shard_urls: list[str] = Field(
+        default_factory=list,
+        description="Database URLs users are sharded across by telegram_id. "
+        "When empty, `database_url` is the only shard",
+    )
+    database_pool_size: int = Field(
+        default=5, description="Connections kept open per database"
+    )
+    database_max_overflow: int = Field(
+        default=10,
+        description="Connections opened beyond the pool size under load (-1 for no "
+        "limit)",
+    )
+    ical_cache_size: int = Field(
+        default=1024,
+        description="Number of rendered iCalendar feeds kept in memory",
+    )
+    stats_cache_size: int = Field(
+        default=1024, description="Number of users whose birthday stats are cached"
+    )
+    stats_global_ttl_seconds: float = Field(
+        default=60, description="Time the stats across all users are cached for"
+    )
+    events_poll_seconds: float = Field(
+        default=60, description="How often the digest is polled for due birthdays"
+    )
+    events_history_size: int = Field(
+        default=10_000, description="Events kept for clients resuming a stream"
+    )
+    events_queue_size: int = Field(
+        default=1000,
+        description="Events buffered per subscriber before it is disconnected",
+    )
+    events_keepalive_seconds: float = Field(default=15)
+    outbox_workers: int = Field(
+        default=0,
+        description="Outbox worker coroutines per shard in each process (0 disables)",
+    )
+    outbox_batch_size: int = Field(default=50)
+    outbox_lease_seconds: float = Field(
+        default=60,
+        description="Time a worker may hold a claimed message before others retry it",
+    )
+    outbox_max_attempts: int = Field(default=8)
+    outbox_retention_days: float = Field(
+        default=7, description="Age after which done and dead messages are deleted"
+    )
+    telegram_bot_token: str | None = Field(default=None)
+    telegram_api_url: str = Field(
+        default="https://api.telegram.org",
+        description="Bot API base URL, e.g. a local stub server in tests",
+    )
+    telegram_global_rate: float = Field(
+        default=30, description="Messages per second across all chats"
+    )
+    telegram_chat_rate: float = Field(
+        default=1, description="Messages per second to a single chat"
+    )
+    telegram_max_concurrency: int = Field(
+        default=16, description="Requests in flight (and pooled connections)"
+    )
+    bloom_capacity: int = Field(
+        default=1_000_000,
+        gt=0,
+        description="Registered users the duplicate registration filter is sized for",
+    )
+    bloom_error_rate: float = Field(
+        default=0.01,
+        gt=0,
+        lt=1,
+        description="Target false positive rate of the duplicate registration filter",
+    )
+    admission_max_in_flight: int = Field(
+        default=256,
+        description="Requests in flight above which low priority routes are shed "
+        "(all routes above twice as many)",
+    )
+    admission_max_loop_lag_ms: float = Field(
+        default=200,
+        description="Event loop lag above which low priority routes are shed",
+    )
+    admission_max_pool_saturation: float = Field(
+        default=1.0,
+        description="Share of pooled DB connections in use above which low priority "
+        "routes are shed",
+    )
+    admission_retry_after: int = Field(
+        default=1, description="Seconds shed clients are told to wait"
+    )
+    loop_watchdog_threshold_ms: float | None = Field(
+        default=None,
+        description="Report event loop blocks longer than this, with their stack "
+        "(disabled when unset)",
+    )
+    backup_dir: str | None = Field(
+        default=None,
+        description="Directory of scheduled SQLite snapshots (disabled when unset)",
+    )
+    backup_interval_hours: float = Field(default=24)
+    backup_keep: int = Field(default=7, description="Snapshots kept per database")
 
     def is_dev(self) -> bool:
         return self.app_env is Environment.development
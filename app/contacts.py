@@ -0,0 +1,357 @@
+"""Import of birthdays from contact files (CSV and vCard).
+
+Uploads are parsed line by line as they arrive, so files of any size are
+imported in constant memory (but for the keys of the user's birthdays, used
+to skip duplicates). Each valid contact becomes a person with a birthday;
+they are inserted in batches of `BATCH_SIZE`, each batch committed in its
+own transaction. Invalid rows are reported with their line number.
+
+CSV files need a header naming their columns: `name` and either `birthday`
+(`YYYY-MM-DD` or `--MM-DD`) or `day`, `month` and optionally `year`, plus
+optional `last_name` and `relationship_type`. Quoted fields cannot span
+lines. vCards are read from their `N` (or `FN`) and `BDAY` properties.
+Lines may end with `\n`, `\r\n` or a bare `\r` (old Mac exports); files with
+lines longer than `MAX_LINE_LENGTH` are rejected.
+"""
+
+import codecs
+import csv
+import logging
+import re
+from collections.abc import AsyncIterator
+from datetime import date
+
+from pydantic import BaseModel as PydanticBaseModel
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.digest import refresh_digest
+from app.models import Birthday, BirthdayCreate, Person, PersonCreate, touch_birthdays
+from app.outbox import enqueue
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+# errors listed in a report, the others are only counted
+MAX_REPORTED_ERRORS = 1000
+# characters, so a file without line breaks can't be buffered whole
+MAX_LINE_LENGTH = 64 * 1024
+
+_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+# YYYY-MM-DD, YYYYMMDD, --MM-DD or --MMDD, optionally followed by a time
+_DATE = re.compile(r"(?:(\d{4})|-)-?(\d{2})-?(\d{2})(?:T.*)?")
+
+Row = tuple[int, dict[str, str] | str]
+
+
+class ContactsError(ValueError):
+    """The file can't be imported at all."""
+
+
+class NoBirthday(ValueError):
+    """The contact has no birthday to import."""
+
+
+class ImportRowError(PydanticBaseModel):
+    line: int
+    error: str
+
+
+class ImportReport(PydanticBaseModel):
+    imported: int = 0
+    duplicates: int = 0
+    without_birthday: int = 0
+    failed: int = 0
+    # the first `MAX_REPORTED_ERRORS` of the failed rows
+    errors: list[ImportRowError] = []
+
+    def add_error(self, line: int, error: str) -> None:
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(ImportRowError(line=line, error=error))
+
+
+async def lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a stream of UTF-8 bytes into lines, without line endings."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        # a trailing \r may be the first half of a \r\n in the next chunk
+        held = "\r" if pending.endswith("\r") else ""
+        *complete, pending = _LINE_BREAK.split(pending.removesuffix("\r"))
+        pending += held
+        for line in complete:
+            yield _checked(line)
+        _checked(pending)
+    pending += decoder.decode(b"", final=True)
+    *complete, pending = _LINE_BREAK.split(pending)
+    for line in complete:
+        yield _checked(line)
+    if pending:
+        yield _checked(pending)
+
+
+def _checked(line: str) -> str:
+    if len(line) > MAX_LINE_LENGTH:
+        raise ContactsError(f"Lines can't be longer than {MAX_LINE_LENGTH} characters")
+    return line
+
+
+async def parse_csv(chunks: AsyncIterator[bytes]) -> AsyncIterator[Row]:
+    """Rows of a CSV file, as (line number, fields or error)."""
+    header: list[str] | None = None
+    line_number = 0
+    async for line in lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            fields = next(csv.reader([line]))
+        except csv.Error as e:
+            if header is None:
+                raise ContactsError(f"Invalid CSV header: {e}") from None
+            yield line_number, f"invalid CSV: {e}"
+            continue
+        if header is None:
+            header = [column.strip().lower() for column in fields]
+            if "name" not in header or not (
+                "birthday" in header or {"day", "month"} <= set(header)
+            ):
+                raise ContactsError(
+                    "CSV header needs a `name` column and either `birthday` or "
+                    "`day` and `month` columns"
+                )
+            continue
+        if len(fields) != len(header):
+            yield line_number, f"expected {len(header)} fields, got {len(fields)}"
+            continue
+        yield line_number, dict(zip(header, fields))
+
+
+async def _unfold(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, str]]:
+    """Logical lines of a vCard file with their first line number (RFC 6350 3.2)."""
+    start, logical = 0, None
+    line_number = 0
+    async for line in lines(chunks):
+        line_number += 1
+        if line[:1] in (" ", "\t") and logical is not None:
+            logical += line[1:]
+            continue
+        if logical is not None:
+            yield start, logical
+        start, logical = line_number, line
+    if logical is not None:
+        yield start, logical
+
+
+def _unescape(value: str) -> str:
+    return (
+        value.replace("\\n", " ")
+        .replace("\\N", " ")
+        .replace("\\,", ",")
+        .replace("\\;", ";")
+        .replace("\\\\", "\\")
+    )
+
+
+async def parse_vcard(chunks: AsyncIterator[bytes]) -> AsyncIterator[Row]:
+    """Contacts of a vCard file, as (line number of BEGIN, fields or error)."""
+    card: dict[str, str] | None = None
+    start = 0
+    async for line_number, line in _unfold(chunks):
+        name, _, value = line.partition(":")
+        prop, *params = name.split(";")
+        # drop the group, e.g. `item1.BDAY`
+        prop = prop.rsplit(".", 1)[-1].upper()
+        if prop == "BEGIN" and value.strip().upper() == "VCARD":
+            card, start = {}, line_number
+        elif card is None:
+            continue
+        elif prop == "END":
+            yield start, _card_fields(card)
+            card = None
+        elif prop in ("N", "FN") and prop not in card:
+            card[prop] = value
+        elif prop == "BDAY" and "birthday" not in card:
+            card["birthday"] = value
+            # Apple contacts store birthdays without a year in a placeholder year
+            for param in params:
+                key, _, omitted = param.partition("=")
+                if key.upper() == "X-APPLE-OMIT-YEAR":
+                    card["omit_year"] = omitted
+    if card is not None:
+        yield start, "vCard without END:VCARD"
+
+
+def _card_fields(card: dict[str, str]) -> dict[str, str]:
+    fields = {}
+    if "N" in card:
+        # family;given;additional;prefixes;suffixes
+        parts = re.split(r"(?<!\\);", card["N"])
+        fields["last_name"] = _unescape(parts[0]).strip()
+        fields["name"] = _unescape(parts[1]).strip() if len(parts) > 1 else ""
+    if not fields.get("name") and "FN" in card:
+        fields["name"] = _unescape(card["FN"]).strip()
+    if "birthday" in card:
+        fields["birthday"] = card["birthday"]
+        if "omit_year" in card and card["birthday"].startswith(card["omit_year"]):
+            month_day = card["birthday"][len(card["omit_year"]) :].lstrip("-")
+            fields["birthday"] = f"--{month_day}"
+    return fields
+
+
+def parse_date(text: str) -> tuple[int, int, int | None]:
+    """(day, month, year) of a date like `1990-12-31`, `19901231` or `--12-31`."""
+    match = _DATE.fullmatch(text.strip())
+    if match is None:
+        raise ValueError(f"invalid date {text!r}")
+    year, month, day = match.groups()
+    return int(day), int(month), int(year) if year else None
+
+
+def to_contact(fields: dict[str, str]) -> tuple[PersonCreate, BirthdayCreate]:
+    """Validate the fields of a row into a person and their birthday."""
+    name = fields.get("name", "").strip()
+    if not name:
+        raise ValueError("name is required")
+    if fields.get("birthday", "").strip():
+        day, month, year = parse_date(fields["birthday"])
+    elif fields.get("day", "").strip() or fields.get("month", "").strip():
+        day, month = fields.get("day", ""), fields.get("month", "")
+        year = fields.get("year", "").strip() or None
+    else:
+        raise NoBirthday
+
+    person = PersonCreate(
+        name=name,
+        last_name=fields.get("last_name", "").strip(),
+        relationship_type=fields.get("relationship_type", "").strip() or None,
+    )
+    birthday = BirthdayCreate(day=day, month=month, year=year)
+    # a leap year, so 29 February without a year passes
+    try:
+        date(birthday.year or 2000, birthday.month, birthday.day)
+    except ValueError:
+        raise ValueError(f"invalid date {birthday.day}/{birthday.month}") from None
+    return person, birthday
+
+
+def _error_message(e: ValueError) -> str:
+    if isinstance(e, ValidationError):
+        return "; ".join(
+            f"{'.'.join(map(str, error['loc']))}: {error['msg']}"
+            for error in e.errors()
+        )
+    return str(e)
+
+
+def _key(person: PersonCreate, birthday: BirthdayCreate) -> tuple:
+    return (
+        person.name.casefold(),
+        person.last_name.casefold(),
+        birthday.day,
+        birthday.month,
+        birthday.year,
+    )
+
+
+async def _existing_keys(db: AsyncSession, user_id: int) -> set[tuple]:
+    result = await db.stream(
+        select(
+            Person.name, Person.last_name, Birthday.day, Birthday.month, Birthday.year
+        )
+        .join(Birthday, Birthday.person_id == Person.id)
+        .where(Person.user_id == user_id)
+        .execution_options(yield_per=10_000)
+    )
+    return {
+        (name.casefold(), last_name.casefold(), day, month, year)
+        async for name, last_name, day, month, year in result
+    }
+
+
+async def _insert_batch(
+    db: AsyncSession, user_id: int, batch: list[tuple[PersonCreate, BirthdayCreate]]
+) -> None:
+    person_ids = (
+        await db.scalars(
+            insert(Person).returning(Person.id, sort_by_parameter_order=True),
+            [{"user_id": user_id, **person.model_dump()} for person, _ in batch],
+        )
+    ).all()
+    birthday_ids = (
+        await db.scalars(
+            insert(Birthday).returning(Birthday.id, sort_by_parameter_order=True),
+            [
+                {"person_id": person_id, **birthday.model_dump()}
+                for person_id, (_, birthday) in zip(person_ids, batch)
+            ],
+        )
+    ).all()
+
+    # bulk inserts bypass the ORM listeners: do their work here
+    await db.execute(touch_birthdays(user_ids=[user_id]))
+    await db.run_sync(refresh_digest, birthday_ids=birthday_ids)
+    await db.run_sync(
+        enqueue,
+        "birthday.created",
+        [
+            {"birthday_id": birthday_id, "person_id": person_id}
+            for birthday_id, person_id in zip(birthday_ids, person_ids)
+        ],
+    )
+    await db.commit()
+
+
+async def import_contacts(
+    db: AsyncSession,
+    user_id: int,
+    rows: AsyncIterator[Row],
+    batch_size: int = BATCH_SIZE,
+) -> ImportReport:
+    """Insert the valid, new contacts of `rows` as persons of the user."""
+    report = ImportReport()
+    seen = await _existing_keys(db, user_id)
+    batch: list[tuple[PersonCreate, BirthdayCreate]] = []
+
+    async for line, fields in rows:
+        if isinstance(fields, str):
+            report.add_error(line, fields)
+            continue
+        try:
+            person, birthday = to_contact(fields)
+        except NoBirthday:
+            report.without_birthday += 1
+            continue
+        except ValueError as e:
+            report.add_error(line, _error_message(e))
+            continue
+
+        key = _key(person, birthday)
+        if key in seen:
+            report.duplicates += 1
+            continue
+        seen.add(key)
+        batch.append((person, birthday))
+
+        if len(batch) >= batch_size:
+            await _insert_batch(db, user_id, batch)
+            report.imported += len(batch)
+            batch = []
+
+    if batch:
+        await _insert_batch(db, user_id, batch)
+        report.imported += len(batch)
+    logger.info(f"Imported contacts of user {user_id}: {report.imported} birthdays")
+    return report
+
+
+PARSERS = {
+    "text/csv": parse_csv,
+    "text/vcard": parse_vcard,
+    "text/x-vcard": parse_vcard,
+    "text/directory": parse_vcard,
+}
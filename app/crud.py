@@ -1,31 +1,555 @@
-from fastapi import HTTPException
-from sqlalchemy import select
-from app.database import SessionDep
-from app.models import UserCreate, User, UserPublic
-from app.routers import user_router
+import asyncio
+import re
+import time
+from collections.abc import AsyncGenerator
+from datetime import date
+from typing import Annotated
+
+from fastapi import (
+    BackgroundTasks,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
+from sqlalchemy import (
+    ColumnElement,
+    and_,
+    bindparam,
+    false,
+    or_,
+    select,
+    true,
+    update,
+)
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.bloom import registered_users
+from app.config import settings
+from app.contacts import PARSERS, ContactsError, ImportReport, import_contacts
+from app.conditional import (
+    etag_matches,
+    http_date,
+    last_modified,
+    not_modified_since,
+)
+from app.database import ShardSessionDep, ShardsDep
+from app.deletion import delete_user_rows, purge_user
+from app.digest import UpcomingBirthdayPublic, as_public, upcoming_birthdays
+from app.events import EventBroker, get_broker
+from app.ical import calendar_birthdays, feed_cache, render_calendar
+from app.models import (
+    Person,
+    PersonPublic,
+    UserCreate,
+    User,
+    UserPublic,
+    UserUpdate,
+    UsersBatchUpdate,
+    UsersBatchUpdateResult,
+    UsersLookup,
+    UsersLookupResult,
+    user_by_telegram_id,
+    user_version,
+    utcnow,
+)
+from app.outbox import enqueue
+from app.search import search_persons
+from app.stats import BirthdayStats, aggregate, stats_cache, summarize
+from app.routers import events_router, stats_router, user_router
 import logging
 
 logger = logging.getLogger(__name__)
 
+# ids per `IN (...)` query, below SQLite's historical limit of 999 parameters
+LOOKUP_CHUNK_SIZE = 500
+
+
+async def get_new_user_db(
+    user: UserCreate, shards: ShardsDep
+) -> AsyncGenerator[AsyncSession, None]:
+    """Yield a session on the shard that will own the user being registered."""
+    async with shards.session_for(user.telegram_id) as session:
+        yield session
+
+
+NewUserSessionDep = Annotated[AsyncSession, Depends(get_new_user_db)]
+
 
 @user_router.post("/", response_model=UserPublic)
-async def create_user_if_not_exists(user: UserCreate, db: SessionDep) -> User:
+async def create_user_if_not_exists(user: UserCreate, db: NewUserSessionDep) -> User:
     logger.debug(f"Received user: {user}")
 
-    logger.info("Searching user in the DB ...")
-    existing_user: User | None = (
-        (await db.execute(select(User).where(User.telegram_id == user.telegram_id)))
-        .scalars()
-        .first()
-    )
+    # only ids the filter has (probably) seen need a lookup to confirm
+    if registered_users.might_exist(user.telegram_id):
+        logger.info("Searching user in the DB ...")
+        existing_user: User | None = (
+            (await db.execute(user_by_telegram_id(user.telegram_id))).scalars().first()
+        )
 
-    if existing_user:
-        logger.error(f"User with name `{user.first_name}` is already registered")
-        raise HTTPException(status_code=409, detail="User already exists")
+        if existing_user:
+            logger.error(f"User with name `{user.first_name}` is already registered")
+            raise HTTPException(status_code=409, detail="User already exists")
 
     logger.info("Creating new user ...")
     db_user: User = User(**user.model_dump())
     db.add(db_user)
-    await db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        # registered concurrently since the filter or lookup said otherwise
+        await db.rollback()
+        logger.error(f"User with name `{user.first_name}` is already registered")
+        raise HTTPException(status_code=409, detail="User already exists")
+    registered_users.add(user.telegram_id)
     await db.refresh(db_user)
     return db_user
+
+
+def user_etag(user_id: int, version: int) -> str:
+    return f'"{user_id}-{version}"'
+
+
+@user_router.get(
+    "/{telegram_id}",
+    response_model=UserPublic,
+    responses={304: {"description": "User not modified"}},
+)
+async def get_user(
+    telegram_id: int,
+    db: ShardSessionDep,
+    response: Response,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> User | Response:
+    if if_none_match is not None:
+        # revalidation only needs the version (from the index alone on Postgres)
+        current = (await db.execute(user_version(telegram_id))).first()
+        if current is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        etag = user_etag(current.id, current.version)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+    user: User | None = (
+        await db.execute(user_by_telegram_id(telegram_id))
+    ).scalar_one_or_none()
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    response.headers["ETag"] = user_etag(user.id, user.version)
+    return user
+
+
+def if_match_clause(header: str) -> ColumnElement[bool]:
+    """WHERE clause selecting the users whose ETag is listed in an `If-Match` header."""
+    conditions = []
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return true()
+        # strong comparison: weak ETags never match
+        match = re.fullmatch(r'"(\d+)-(\d+)"', candidate)
+        if match:
+            user_id, version = map(int, match.groups())
+            conditions.append(and_(User.id == user_id, User.version == version))
+    return or_(false(), *conditions)
+
+
+def _update_values(changes: dict) -> dict:
+    """SET clause of a user update, bumping the version like the ORM does."""
+    if "first_name" in changes and changes["first_name"] is None:
+        raise HTTPException(status_code=422, detail="first_name cannot be null")
+    return {**changes, "version": User.version + 1, "updated_at": utcnow()}
+
+
+@user_router.patch(
+    "/{telegram_id}",
+    response_model=UserPublic,
+    responses={412: {"description": "User modified since `If-Match` ETag"}},
+)
+async def update_user(
+    telegram_id: int,
+    changes: UserUpdate,
+    db: ShardSessionDep,
+    response: Response,
+    if_match: Annotated[str | None, Header()] = None,
+) -> User:
+    """Partially update a user; with `If-Match`, only if it is still at that version.
+
+    The check and the write are a single `UPDATE ... RETURNING`, so there is
+    no window for a concurrent update in between.
+    """
+    values = changes.model_dump(exclude_unset=True)
+    conditions = [User.telegram_id == telegram_id]
+    if if_match is not None:
+        conditions.append(if_match_clause(if_match))
+
+    if values:
+        user: User | None = (
+            await db.scalars(
+                update(User)
+                .where(*conditions)
+                .values(_update_values(values))
+                .returning(User)
+                .execution_options(populate_existing=True)
+            )
+        ).one_or_none()
+        if user is not None:
+            # Core updates bypass the outbox listener
+            await db.run_sync(enqueue, "user.updated", [{"telegram_id": telegram_id}])
+            await db.commit()
+    else:
+        user = (await db.scalars(select(User).where(*conditions))).one_or_none()
+
+    if user is None:
+        exists = await db.scalar(select(User.id).where(User.telegram_id == telegram_id))
+        if exists is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        raise HTTPException(status_code=412, detail="User was modified")
+
+    response.headers["ETag"] = user_etag(user.id, user.version)
+    return user
+
+
+@user_router.delete(
+    "/{telegram_id}",
+    status_code=204,
+    responses={
+        202: {"description": "User being purged in the background"},
+        404: {"description": "User not found"},
+    },
+)
+async def delete_user(
+    telegram_id: int,
+    db: ShardSessionDep,
+    shards: ShardsDep,
+    background_tasks: BackgroundTasks,
+    background: Annotated[
+        bool,
+        Query(description="Purge in batches after answering, for large accounts"),
+    ] = False,
+) -> Response:
+    """Delete a user with their persons and birthdays."""
+    user_id: int | None = await db.scalar(
+        select(User.id).where(User.telegram_id == telegram_id)
+    )
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    if background:
+        background_tasks.add_task(purge_user, shards, telegram_id)
+        return Response(status_code=202)
+
+    logger.info(f"Deleting user {user_id} ...")
+    await delete_user_rows(db, user_id, telegram_id)
+    await db.commit()
+    return Response(status_code=204)
+
+
+@user_router.patch("/", response_model=UsersBatchUpdateResult)
+async def update_users(batch: UsersBatchUpdate, shards: ShardsDep) -> dict:
+    """Partially update many users, one `executemany` per shard and set of fields.
+
+    Updates of a shard are applied in one transaction; shards commit
+    independently. Several updates of the same user are merged in order.
+    """
+    updates: dict[int, dict] = {}
+    for item in batch.users:
+        changes = item.model_dump(exclude_unset=True, exclude={"telegram_id"})
+        updates.setdefault(item.telegram_id, {}).update(changes)
+    for changes in updates.values():
+        _update_values(changes)
+
+    async def apply(index: int, telegram_ids: list[int]) -> list[int]:
+        async with shards.sessionmakers[index]() as session:
+            existing: set[int] = set()
+            for start in range(0, len(telegram_ids), LOOKUP_CHUNK_SIZE):
+                chunk = telegram_ids[start : start + LOOKUP_CHUNK_SIZE]
+                existing.update(
+                    await session.scalars(
+                        select(User.telegram_id).where(User.telegram_id.in_(chunk))
+                    )
+                )
+
+            # one statement per set of changed fields, executed for all its users
+            by_fields: dict[tuple[str, ...], list[dict]] = {}
+            for telegram_id in telegram_ids:
+                changes = updates[telegram_id]
+                if telegram_id in existing and changes:
+                    by_fields.setdefault(tuple(sorted(changes)), []).append(
+                        {"b_telegram_id": telegram_id}
+                        | {f"b_{field}": value for field, value in changes.items()}
+                    )
+            connection = await session.connection()
+            for fields, params in by_fields.items():
+                statement = (
+                    update(User.__table__)
+                    .where(User.telegram_id == bindparam("b_telegram_id"))
+                    .values(_update_values({f: bindparam(f"b_{f}") for f in fields}))
+                )
+                await connection.execute(statement, params)
+
+            await session.run_sync(
+                enqueue,
+                "user.updated",
+                [
+                    {"telegram_id": telegram_id}
+                    for telegram_id in telegram_ids
+                    if telegram_id in existing and updates[telegram_id]
+                ],
+            )
+            await session.commit()
+        return [telegram_id for telegram_id in telegram_ids if telegram_id in existing]
+
+    logger.info(f"Updating {len(updates)} users ...")
+    results = await asyncio.gather(
+        *(
+            apply(index, telegram_ids)
+            for index, telegram_ids in shards.group_by_shard(updates).items()
+        )
+    )
+    updated = {telegram_id for telegram_ids in results for telegram_id in telegram_ids}
+
+    return {
+        "updated": [telegram_id for telegram_id in updates if telegram_id in updated],
+        "missing": [
+            telegram_id for telegram_id in updates if telegram_id not in updated
+        ],
+    }
+
+
+@user_router.post("/lookup", response_model=UsersLookupResult)
+async def lookup_users(lookup: UsersLookup, shards: ShardsDep) -> dict:
+    """Resolve many telegram_ids at once, reporting the ones not registered."""
+    requested = list(dict.fromkeys(lookup.telegram_ids))
+
+    async def fetch(index: int, telegram_ids: list[int]) -> list[User]:
+        users: list[User] = []
+        async with shards.sessionmakers[index]() as session:
+            for start in range(0, len(telegram_ids), LOOKUP_CHUNK_SIZE):
+                chunk = telegram_ids[start : start + LOOKUP_CHUNK_SIZE]
+                users += await session.scalars(
+                    select(User).where(User.telegram_id.in_(chunk))
+                )
+        return users
+
+    logger.info(f"Looking up {len(requested)} users ...")
+    results = await asyncio.gather(
+        *(
+            fetch(index, telegram_ids)
+            for index, telegram_ids in shards.group_by_shard(requested).items()
+        )
+    )
+    found = {user.telegram_id: user for users in results for user in users}
+
+    return {
+        "found": found,
+        "missing": [
+            telegram_id for telegram_id in requested if telegram_id not in found
+        ],
+    }
+
+
+@user_router.get(
+    "/{telegram_id}/birthdays.ics",
+    response_class=Response,
+    responses={
+        200: {"content": {"text/calendar": {}}},
+        304: {"description": "Feed not modified"},
+        404: {"description": "User not found"},
+    },
+)
+async def get_birthdays_calendar(
+    telegram_id: int,
+    db: ShardSessionDep,
+    if_none_match: Annotated[str | None, Header()] = None,
+    if_modified_since: Annotated[str | None, Header()] = None,
+) -> Response:
+    """iCalendar feed of the user's birthdays, for calendar app subscriptions."""
+    user = (
+        await db.execute(
+            select(
+                User.id,
+                User.first_name,
+                User.version,
+                User.updated_at,
+                User.birthdays_version,
+                User.birthdays_updated_at,
+            ).where(User.telegram_id == telegram_id)
+        )
+    ).first()
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    # the feed is named after the user, so renames change it too
+    etag = f'"{user.id}-{user.version}-{user.birthdays_version}"'
+    modified = max(user.updated_at, user.birthdays_updated_at)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(last_modified(modified)),
+        "Cache-Control": "private, no-cache",
+    }
+
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+    if if_none_match is not None:
+        not_modified = etag_matches(if_none_match, etag)
+    else:
+        not_modified = not_modified_since(if_modified_since, modified)
+    if not_modified:
+        logger.debug(f"Calendar of user {user.id} not modified")
+        return Response(status_code=304, headers=headers)
+
+    body = feed_cache.get((telegram_id, etag))
+    if body is None:
+        logger.info(f"Rendering calendar of user {user.id} ...")
+        rows = await db.execute(calendar_birthdays(user.id))
+        body = render_calendar(
+            rows,
+            stamp=user.birthdays_updated_at,
+            name=f"Birthdays of {user.first_name}",
+        )
+        feed_cache.set((telegram_id, etag), body)
+
+    return Response(body, media_type="text/calendar", headers=headers)
+
+
+@user_router.get("/{telegram_id}/persons/search", response_model=list[PersonPublic])
+async def search_user_persons(
+    telegram_id: int,
+    db: ShardSessionDep,
+    q: Annotated[str, Query(min_length=1, max_length=100)],
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+) -> list[Person]:
+    """Persons of the user whose names start with the typed words, best match first."""
+    user_id: int | None = (
+        await db.execute(select(User.id).where(User.telegram_id == telegram_id))
+    ).scalar_one_or_none()
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return await search_persons(db, user_id, q, limit=limit)
+
+
+@user_router.get("/{telegram_id}/digest", response_model=list[UpcomingBirthdayPublic])
+async def get_upcoming_birthdays(
+    telegram_id: int,
+    db: ShardSessionDep,
+    days: Annotated[int, Query(ge=1, le=366)] = 7,
+) -> list[UpcomingBirthdayPublic]:
+    """Birthdays of the user's persons in the next `days` days, soonest first."""
+    user_id: int | None = (
+        await db.execute(select(User.id).where(User.telegram_id == telegram_id))
+    ).scalar_one_or_none()
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    rows = await db.scalars(upcoming_birthdays(user_id, date.today(), days))
+    return as_public(rows)
+
+
+@user_router.get("/{telegram_id}/stats", response_model=BirthdayStats)
+async def get_user_stats(
+    telegram_id: int,
+    db: ShardSessionDep,
+    days: Annotated[int, Query(ge=1, le=366)] = 30,
+) -> BirthdayStats:
+    """Histograms of the user's birthdays, and how many fall in the next `days` days."""
+    user = (
+        await db.execute(
+            select(User.id, User.birthdays_version).where(
+                User.telegram_id == telegram_id
+            )
+        )
+    ).first()
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    today = date.today()
+    key = (telegram_id, user.birthdays_version, today)
+    aggregates = stats_cache.get(key)
+    if aggregates is None:
+        logger.info(f"Aggregating birthday stats of user {user.id} ...")
+        aggregates = await aggregate(db, today, user.id)
+        stats_cache.set(key, aggregates)
+    return summarize(aggregates, today, days)
+
+
+@stats_router.get("/", response_model=BirthdayStats)
+async def get_stats(
+    shards: ShardsDep, days: Annotated[int, Query(ge=1, le=366)] = 30
+) -> BirthdayStats:
+    """Histograms of everyone's birthdays, cached for `stats_global_ttl_seconds`."""
+    today = date.today()
+    # no version covers every user: cache for a time slot instead
+    slot = int(time.monotonic() // settings.stats_global_ttl_seconds)
+    key = ("all", today, slot)
+    aggregates = stats_cache.get(key)
+    if aggregates is None:
+        logger.info("Aggregating birthday stats of all users ...")
+        per_shard = await shards.fan_out(lambda session: aggregate(session, today))
+        aggregates = sum(per_shard[1:], per_shard[0])
+        stats_cache.set(key, aggregates)
+    return summarize(aggregates, today, days)
+
+
+@user_router.post(
+    "/{telegram_id}/birthdays/import",
+    response_model=ImportReport,
+    responses={
+        404: {"description": "User not found"},
+        415: {"description": "Not a CSV or vCard file"},
+        422: {"description": "File can't be imported, e.g. bad CSV header"},
+    },
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {media_type: {} for media_type in PARSERS},
+        }
+    },
+)
+async def import_birthdays(
+    telegram_id: int,
+    request: Request,
+    db: ShardSessionDep,
+    content_type: Annotated[str | None, Header()] = None,
+) -> ImportReport:
+    """Import the birthdays of a CSV or vCard contacts file, streamed as the body."""
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    parse = PARSERS.get(media_type)
+    if parse is None:
+        raise HTTPException(
+            status_code=415, detail=f"Expected one of {', '.join(PARSERS)}"
+        )
+
+    user_id: int | None = (
+        await db.execute(select(User.id).where(User.telegram_id == telegram_id))
+    ).scalar_one_or_none()
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    try:
+        return await import_contacts(db, user_id, parse(request.stream()))
+    except ContactsError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@events_router.get(
+    "/",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {}}}},
+)
+async def stream_events(
+    broker: Annotated[EventBroker, Depends(get_broker)],
+    last_event_id: Annotated[str | None, Header()] = None,
+    telegram_id: int | None = None,
+) -> StreamingResponse:
+    """Birthdays falling due, as server-sent events; optionally of one user only."""
+    return StreamingResponse(
+        broker.stream(last_event_id, telegram_id),
+        media_type="text/event-stream",
+        # proxies must pass events on as they come
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,9 +1,13 @@
+import asyncio
+import hashlib
 import logging
-from collections.abc import AsyncGenerator
-from typing import Annotated
+from collections.abc import AsyncGenerator, Awaitable, Callable, Iterable
+from typing import Annotated, TypeVar
 
 from fastapi import Depends
+from sqlalchemy import event, make_url
 from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
     AsyncSession,
     async_sessionmaker,
     create_async_engine,
@@ -14,27 +18,139 @@ from app.config import settings
 
 logger = logging.getLogger(__name__)
 
-DATABASE_URL = settings.database_url
+T = TypeVar("T")
 
-kwargs = {}
-if DATABASE_URL.startswith("sqlite"):
-    # for sqlite, add check_same_thread=False to allow multi-threaded access in dev/test
-    kwargs["connect_args"] = {"check_same_thread": False}
+DATABASE_URL = settings.database_url
+SHARD_URLS: list[str] = settings.database_shard_urls or [DATABASE_URL]
 
 # only print DB transactions in development
 # this might be eventually removed...
 is_dev: bool = settings.is_dev()
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=is_dev,
-    pool_pre_ping=True,
-    **kwargs,
-)
-async_session = async_sessionmaker(
-    bind=engine,
-    class_=AsyncSession,
-    expire_on_commit=False,
-)
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """Per-connection SQLite settings, to be run on `connect`."""
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers (requests, backups) run alongside a writer
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # off by default in SQLite: without it ON DELETE CASCADE does nothing
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def _create_engine(url: str) -> AsyncEngine:
+    kwargs = {}
+    if url.startswith("sqlite"):
+        # for sqlite, add check_same_thread=False to allow multi-threaded access in dev/test
+        kwargs["connect_args"] = {"check_same_thread": False}
+    if make_url(url).database not in (None, "", ":memory:"):
+        # in-memory sqlite shares a single connection, there is no pool to size
+        kwargs["pool_size"] = settings.database_pool_size
+        kwargs["max_overflow"] = settings.database_max_overflow
+
+    engine = create_async_engine(
+        url,
+        echo=is_dev,
+        pool_pre_ping=True,
+        **kwargs,
+    )
+    if url.startswith("sqlite"):
+        event.listen(engine.sync_engine, "connect", set_sqlite_pragmas)
+    return engine
+
+
+def _create_sessionmaker(engine: AsyncEngine) -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(
+        bind=engine,
+        class_=AsyncSession,
+        expire_on_commit=False,
+    )
+
+
+def shard_index(telegram_id: int, n_shards: int) -> int:
+    """Map a telegram_id to a shard index.
+
+    Uses blake2b rather than `hash()` so the mapping is stable across processes
+    and Python versions.
+    """
+    digest = hashlib.blake2b(
+        telegram_id.to_bytes(8, "big", signed=True), digest_size=8
+    ).digest()
+    return int.from_bytes(digest, "big") % n_shards
+
+
+class Shards:
+    """Set of databases that users are partitioned across by hash of telegram_id.
+
+    Everything that belongs to a user (persons, birthdays, ...) lives in the
+    user's shard, so per-user requests touch a single database and only
+    cross-user scans need to fan out.
+    """
+
+    def __init__(self, sessionmakers: list[async_sessionmaker[AsyncSession]]):
+        if not sessionmakers:
+            raise ValueError("At least one shard is required")
+        self.sessionmakers = sessionmakers
+
+    @classmethod
+    def from_urls(cls, urls: list[str]) -> "Shards":
+        return cls([_create_sessionmaker(_create_engine(url)) for url in urls])
+
+    def __len__(self) -> int:
+        return len(self.sessionmakers)
+
+    @property
+    def engines(self) -> list[AsyncEngine]:
+        return [sessionmaker.kw["bind"] for sessionmaker in self.sessionmakers]
+
+    def index_for(self, telegram_id: int) -> int:
+        return shard_index(telegram_id, len(self.sessionmakers))
+
+    def session_for(self, telegram_id: int) -> AsyncSession:
+        """Open a session on the shard owning `telegram_id`."""
+        return self.sessionmakers[self.index_for(telegram_id)]()
+
+    def group_by_shard(self, telegram_ids: Iterable[int]) -> dict[int, list[int]]:
+        """Group telegram_ids by the index of the shard owning them."""
+        groups: dict[int, list[int]] = {}
+        for telegram_id in telegram_ids:
+            groups.setdefault(self.index_for(telegram_id), []).append(telegram_id)
+        return groups
+
+    async def fan_out(self, fn: Callable[[AsyncSession], Awaitable[T]]) -> list[T]:
+        """Run `fn` concurrently on every shard, each with its own session.
+
+        Results are returned in shard order; merging them is up to the caller.
+        """
+
+        async def run(sessionmaker: async_sessionmaker[AsyncSession]) -> T:
+            async with sessionmaker() as session:
+                return await fn(session)
+
+        return list(await asyncio.gather(*(run(sm) for sm in self.sessionmakers)))
+
+    async def scan(
+        self, fn: Callable[[AsyncSession], Awaitable[Iterable[T]]]
+    ) -> list[T]:
+        """Fan `fn` out to every shard and concatenate the returned rows."""
+        return [row for rows in await self.fan_out(fn) for row in rows]
+
+    async def create_all(self) -> None:
+        async def create(engine: AsyncEngine) -> None:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+
+        await asyncio.gather(*(create(engine) for engine in self.engines))
+
+    async def dispose(self) -> None:
+        await asyncio.gather(*(engine.dispose() for engine in self.engines))
+
+
+shards = Shards.from_urls(SHARD_URLS)
+
+# the first shard doubles as the default database for code that is not user-scoped
+engine = shards.engines[0]
+async_session = shards.sessionmakers[0]
 
 
 # create base model for tables
@@ -47,17 +163,36 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
         yield session
 
 
+def get_shards() -> Shards:
+    return shards
+
+
 async def close_engine() -> None:
-    logger.info("Disposing database engine")
-    await engine.dispose()
+    logger.info(f"Disposing database engines ({len(shards)} shards)")
+    await shards.dispose()
 
 
 # this session dependency can be injected into the endpoints
 SessionDep = Annotated[AsyncSession, Depends(get_db)]
+ShardsDep = Annotated[Shards, Depends(get_shards)]
+
+
+async def get_shard_db(
+    telegram_id: int, shards: ShardsDep
+) -> AsyncGenerator[AsyncSession, None]:
+    """Yield a session on the shard owning `telegram_id`.
+
+    `telegram_id` is resolved by FastAPI from the path or query of the request.
+    """
+    async with shards.session_for(telegram_id) as session:
+        yield session
+
+
+# like `SessionDep`, but bound to the shard of the requested user
+ShardSessionDep = Annotated[AsyncSession, Depends(get_shard_db)]
 
 
 # utility to create database and tables
 async def create_db_and_tables():
-    logger.debug("Creating db and tables ...")
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    logger.debug(f"Creating db and tables in {len(shards)} shards ...")
+    await shards.create_all()
@@ -0,0 +1,98 @@
+"""Deletion of users and everything they own.
+
+Rows are deleted with set-based `DELETE ... WHERE` statements, children
+first, so nothing is loaded into memory whatever the size of the account.
+Small accounts go in one transaction. Large ones can be purged in the
+background, in batches of short transactions that each hold the write lock
+briefly, before the user row itself is deleted.
+"""
+
+import logging
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import Shards
+from app.digest import UpcomingBirthday
+from app.models import Birthday, Person, User, touch_birthdays
+from app.outbox import enqueue
+
+logger = logging.getLogger(__name__)
+
+PURGE_BATCH_SIZE = 1000
+
+
+async def delete_user_rows(
+    session: AsyncSession, user_id: int, telegram_id: int
+) -> bool:
+    """Delete a user and all their rows in the session's transaction.
+
+    Bypasses the ORM, so only a `user.deleted` outbox message is recorded,
+    not one per birthday. Returns whether the user was still there.
+    """
+    persons = select(Person.id).where(Person.user_id == user_id)
+    await session.execute(
+        delete(UpcomingBirthday).where(UpcomingBirthday.user_id == user_id)
+    )
+    await session.execute(delete(Birthday).where(Birthday.person_id.in_(persons)))
+    await session.execute(delete(Person).where(Person.user_id == user_id))
+    result = await session.execute(delete(User).where(User.id == user_id))
+    if result.rowcount == 0:
+        return False
+    await session.run_sync(enqueue, "user.deleted", [{"telegram_id": telegram_id}])
+    return True
+
+
+async def _delete_batches(session: AsyncSession, user_id: int, ids, column) -> int:
+    """Delete rows whose `column` is among `ids`, a batch per transaction."""
+    deleted = 0
+    while True:
+        result = await session.execute(
+            delete(column.table).where(column.in_(ids.limit(PURGE_BATCH_SIZE)))
+        )
+        await session.execute(touch_birthdays(user_ids=[user_id]))
+        await session.commit()
+        deleted += result.rowcount
+        if result.rowcount < PURGE_BATCH_SIZE:
+            return deleted
+
+
+async def purge_user(shards: Shards, telegram_id: int) -> None:
+    """Delete a user's data in batches, then the user, on the user's shard.
+
+    Until the final transaction the user exists with part of their data.
+    """
+    async with shards.session_for(telegram_id) as session:
+        user_id = await session.scalar(
+            select(User.id).where(User.telegram_id == telegram_id)
+        )
+        if user_id is None:
+            return
+
+        logger.info(f"Purging user {user_id} ...")
+        await _delete_batches(
+            session,
+            user_id,
+            select(UpcomingBirthday.birthday_id).where(
+                UpcomingBirthday.user_id == user_id
+            ),
+            UpcomingBirthday.birthday_id,
+        )
+        birthdays = await _delete_batches(
+            session,
+            user_id,
+            select(Birthday.id)
+            .join(Person, Person.id == Birthday.person_id)
+            .where(Person.user_id == user_id),
+            Birthday.id,
+        )
+        persons = await _delete_batches(
+            session,
+            user_id,
+            select(Person.id).where(Person.user_id == user_id),
+            Person.id,
+        )
+        # also picks up whatever was added in the meantime
+        await delete_user_rows(session, user_id, telegram_id)
+        await session.commit()
+        logger.info(f"Purged user {user_id}: {birthdays} birthdays, {persons} persons")
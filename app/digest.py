@@ -0,0 +1,296 @@
+"""Materialized table of every birthday's next occurrence, for upcoming digests.
+
+Each birthday has one row holding the next date it is celebrated on, keyed by
+(user_id, next_date, birthday_id), so "birthdays in the next N days" is a
+primary-key range read. Rows are refreshed on every ORM write of persons and
+birthdays, and rolled forward once a day when their date has passed.
+"""
+
+import argparse
+import asyncio
+import calendar
+import logging
+from collections.abc import Collection, Iterable
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from itertools import chain
+
+from pydantic import BaseModel as PydanticBaseModel
+from sqlalchemy import ForeignKey, Select, delete, event, insert, or_, select
+from sqlalchemy.orm import Mapped, Session, mapped_column
+
+from app.database import Base, Shards, shards
+from app.models import Birthday, Person
+
+logger = logging.getLogger(__name__)
+
+
+class UpcomingBirthday(Base):
+    __tablename__ = "upcoming_birthday"
+
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("user.id", ondelete="CASCADE"), primary_key=True
+    )
+    next_date: Mapped[date] = mapped_column(primary_key=True, index=True)
+    birthday_id: Mapped[int] = mapped_column(
+        ForeignKey("birthday.id", ondelete="CASCADE"), primary_key=True, unique=True
+    )
+    # denormalized from person/birthday so digests never join
+    person_id: Mapped[int] = mapped_column(index=True, nullable=False)
+    name: Mapped[str] = mapped_column(nullable=False)
+    last_name: Mapped[str] = mapped_column(nullable=False)
+    year: Mapped[int | None] = mapped_column(default=None, nullable=True)
+
+
+class UpcomingBirthdayPublic(PydanticBaseModel):
+    person_id: int
+    name: str
+    last_name: str
+    date: date
+    age: int | None = None
+
+
+def next_occurrence(day: int, month: int, today: date) -> date | None:
+    """Next date, from `today` on, a birthday on `day`/`month` is celebrated.
+
+    29 February is celebrated on the 28th in non-leap years. Returns None for
+    dates that never exist (e.g. 31 April).
+    """
+    for year in (today.year, today.year + 1):
+        if month == 2 and day == 29 and not calendar.isleap(year):
+            candidate = date(year, 2, 28)
+        else:
+            try:
+                candidate = date(year, month, day)
+            except ValueError:
+                return None
+        if candidate >= today:
+            return candidate
+    return None
+
+
+def _source_rows(
+    session: Session,
+    today: date,
+    birthday_ids: Collection[int] = (),
+    person_ids: Collection[int] = (),
+    user_ids: Collection[int] | None = (),
+) -> list[dict]:
+    """Digest rows computed from scratch; `user_ids=None` selects every user."""
+    stmt = select(
+        Birthday.id,
+        Birthday.day,
+        Birthday.month,
+        Birthday.year,
+        Person.id.label("person_id"),
+        Person.user_id,
+        Person.name,
+        Person.last_name,
+    ).join(Person, Birthday.person_id == Person.id)
+    if user_ids is not None:
+        stmt = stmt.where(
+            or_(
+                Birthday.id.in_(list(birthday_ids)),
+                Person.id.in_(list(person_ids)),
+                Person.user_id.in_(list(user_ids)),
+            )
+        )
+
+    rows = []
+    for row in session.execute(stmt):
+        next_date = next_occurrence(row.day, row.month, today)
+        if next_date is None:
+            continue
+        rows.append(
+            {
+                "user_id": row.user_id,
+                "next_date": next_date,
+                "birthday_id": row.id,
+                "person_id": row.person_id,
+                "name": row.name,
+                "last_name": row.last_name,
+                "year": row.year,
+            }
+        )
+    return rows
+
+
+def refresh_digest(
+    session: Session,
+    birthday_ids: Collection[int] = (),
+    person_ids: Collection[int] = (),
+    user_ids: Collection[int] = (),
+    today: date | None = None,
+) -> None:
+    """Recompute the digest rows of the given birthdays, persons and users.
+
+    Writes that bypass the ORM unit of work must call it themselves, in the
+    same transaction (from async code, through `AsyncSession.run_sync`).
+    """
+    if not (birthday_ids or person_ids or user_ids):
+        return
+    today = today or date.today()
+
+    session.execute(
+        delete(UpcomingBirthday)
+        .where(
+            or_(
+                UpcomingBirthday.birthday_id.in_(list(birthday_ids)),
+                UpcomingBirthday.person_id.in_(list(person_ids)),
+                UpcomingBirthday.user_id.in_(list(user_ids)),
+            )
+        )
+        .execution_options(synchronize_session=False)
+    )
+    rows = _source_rows(session, today, birthday_ids, person_ids, user_ids)
+    if rows:
+        session.execute(insert(UpcomingBirthday), rows)
+
+
+def roll_forward(session: Session, today: date | None = None) -> int:
+    """Move every row whose date has passed to its next occurrence."""
+    today = today or date.today()
+    birthday_ids = list(
+        session.scalars(
+            select(UpcomingBirthday.birthday_id).where(
+                UpcomingBirthday.next_date < today
+            )
+        )
+    )
+    refresh_digest(session, birthday_ids=birthday_ids, today=today)
+    return len(birthday_ids)
+
+
+@dataclass
+class DigestDiff:
+    birthday_id: int
+    expected: dict | None
+    actual: dict | None
+
+
+def check_digest(
+    session: Session,
+    user_ids: Collection[int] | None = None,
+    today: date | None = None,
+    repair: bool = False,
+) -> list[DigestDiff]:
+    """Rebuild the digest from scratch and diff it against the stored rows.
+
+    Checks every user when `user_ids` is None. With `repair`, the stored rows
+    of the users found inconsistent are replaced with the rebuilt ones.
+    """
+    today = today or date.today()
+    expected = {
+        row["birthday_id"]: row
+        for row in _source_rows(session, today, user_ids=user_ids)
+    }
+
+    table = UpcomingBirthday.__table__
+    stmt = select(table)
+    if user_ids is not None:
+        stmt = stmt.where(table.c.user_id.in_(list(user_ids)))
+    actual = {row["birthday_id"]: dict(row) for row in session.execute(stmt).mappings()}
+
+    diffs = [
+        DigestDiff(birthday_id, expected.get(birthday_id), actual.get(birthday_id))
+        for birthday_id in sorted(expected.keys() | actual.keys())
+        if expected.get(birthday_id) != actual.get(birthday_id)
+    ]
+    if diffs:
+        logger.warning(f"Found {len(diffs)} inconsistent digest rows")
+    if diffs and repair:
+        broken_users = {
+            row["user_id"]
+            for diff in diffs
+            for row in (diff.expected, diff.actual)
+            if row
+        }
+        refresh_digest(session, user_ids=broken_users, today=today)
+    return diffs
+
+
+@event.listens_for(Session, "after_flush")
+def _refresh_digest_on_flush(session: Session, flush_context) -> None:
+    """Keep the digest in step with ORM writes of persons and birthdays."""
+    birthday_ids: set[int] = set()
+    person_ids: set[int] = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Birthday):
+            birthday_ids.add(obj.id)
+        elif isinstance(obj, Person) and obj not in session.new:
+            person_ids.add(obj.id)
+
+    refresh_digest(session, birthday_ids=birthday_ids, person_ids=person_ids)
+
+
+def upcoming_birthdays(user_id: int, today: date, days: int) -> Select:
+    """Statement of the user's birthdays in the `days` days from `today`, soonest first."""
+    return (
+        select(UpcomingBirthday)
+        .where(
+            UpcomingBirthday.user_id == user_id,
+            UpcomingBirthday.next_date >= today,
+            UpcomingBirthday.next_date < today + timedelta(days=days),
+        )
+        .order_by(UpcomingBirthday.next_date, UpcomingBirthday.birthday_id)
+    )
+
+
+def as_public(rows: Iterable[UpcomingBirthday]) -> list[UpcomingBirthdayPublic]:
+    return [
+        UpcomingBirthdayPublic(
+            person_id=row.person_id,
+            name=row.name,
+            last_name=row.last_name,
+            date=row.next_date,
+            age=row.next_date.year - row.year if row.year else None,
+        )
+        for row in rows
+    ]
+
+
+async def roll_forward_daily(shards: Shards) -> None:
+    """Roll the digest of every shard forward now and then after each midnight."""
+
+    async def roll(session) -> int:
+        moved = await session.run_sync(roll_forward)
+        await session.commit()
+        return moved
+
+    while True:
+        try:
+            moved = sum(await shards.fan_out(roll))
+            logger.info(f"Rolled {moved} digest rows forward")
+        except Exception as e:
+            logger.error(f"Rolling the digest forward failed: {e}")
+
+        now = datetime.now()
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        await asyncio.sleep((midnight - now).total_seconds())
+
+
+async def _check_all_shards(repair: bool) -> list[DigestDiff]:
+    async def check(session) -> list[DigestDiff]:
+        diffs = await session.run_sync(check_digest, None, None, repair)
+        await session.commit()
+        return diffs
+
+    return await shards.scan(check)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check the upcoming birthdays digest against its source tables"
+    )
+    parser.add_argument(
+        "--repair", action="store_true", help="rebuild the rows found inconsistent"
+    )
+    args = parser.parse_args()
+
+    diffs = asyncio.run(_check_all_shards(args.repair))
+    for diff in diffs:
+        print(
+            f"birthday {diff.birthday_id}: expected {diff.expected}, got {diff.actual}"
+        )
+    print(f"{len(diffs)} inconsistent rows" + (" (repaired)" if args.repair else ""))
+    raise SystemExit(1 if diffs and not args.repair else 0)
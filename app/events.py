@@ -0,0 +1,237 @@
+"""Server-sent events stream of birthdays falling due.
+
+A single broker per process polls the digest of every shard for birthdays
+due today, once per `interval` however many clients are subscribed, and
+pushes each one to every subscriber once. Idle subscribers cost a coroutine
+and a queue each, plus a keep-alive comment now and then.
+
+Events carry ids `<broker epoch>-<sequence>`. Clients reconnecting with a
+`Last-Event-ID` get the events they missed replayed from a history ring
+buffer. Ids from an earlier process, or too old for the history, replay the
+whole history, so delivery is at-least-once: dedupe on `(telegram_id,
+birthday_id, date)`, as birthday ids are only unique within a shard. A
+subscriber whose bounded queue fills up is disconnected, and picks
+up where it left off when it reconnects.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
+from datetime import date
+
+from sqlalchemy import Select, select
+
+from app.config import settings
+from app.database import Shards, shards
+from app.digest import UpcomingBirthday, UpcomingBirthdayPublic
+from app.models import User
+
+logger = logging.getLogger(__name__)
+
+# reconnection delay suggested to clients, in milliseconds
+RETRY_MS = 5000
+
+
+def due_birthdays(today: date) -> Select:
+    """Statement of every birthday celebrated `today`, with its user's telegram_id."""
+    return (
+        select(UpcomingBirthday, User.telegram_id)
+        .join(User, User.id == UpcomingBirthday.user_id)
+        .where(UpcomingBirthday.next_date == today)
+        .order_by(UpcomingBirthday.birthday_id)
+    )
+
+
+class BirthdayDueEvent(UpcomingBirthdayPublic):
+    telegram_id: int
+    birthday_id: int
+
+
+@dataclass(frozen=True)
+class Event:
+    sequence: int
+    id: str
+    event: BirthdayDueEvent
+
+    def encode(self) -> str:
+        return (
+            f"id: {self.id}\nevent: birthday\ndata: {self.event.model_dump_json()}\n\n"
+        )
+
+
+class Subscriber:
+    def __init__(self, queue_size: int, telegram_id: int | None = None):
+        self.telegram_id = telegram_id
+        # None marks the end of the stream
+        self.queue: asyncio.Queue[Event | None] = asyncio.Queue(maxsize=queue_size)
+
+    def wants(self, event: Event) -> bool:
+        return self.telegram_id is None or event.event.telegram_id == self.telegram_id
+
+    def close(self) -> None:
+        # make room for the end marker: the client replays what it missed
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class EventBroker:
+    def __init__(
+        self,
+        shards: Shards,
+        interval: float = 60,
+        history_size: int = 10_000,
+        queue_size: int = 1000,
+        keepalive: float = 15,
+    ):
+        self.shards = shards
+        self.interval = interval
+        self.queue_size = queue_size
+        self.keepalive = keepalive
+        self.epoch = str(time.time_ns())
+        self.history: deque[Event] = deque(maxlen=history_size)
+        self.subscribers: set[Subscriber] = set()
+        self.closed = False
+        self.dropped = 0
+        self._sequence = 0
+        self._today: date | None = None
+        # (telegram_id, birthday_id) published for `_today`: birthday ids are
+        # only unique within a shard
+        self._published: set[tuple[int, int]] = set()
+
+    @classmethod
+    def from_settings(cls) -> "EventBroker":
+        return cls(
+            shards,
+            interval=settings.events_poll_seconds,
+            history_size=settings.events_history_size,
+            queue_size=settings.events_queue_size,
+            keepalive=settings.events_keepalive_seconds,
+        )
+
+    def publish(self, due: BirthdayDueEvent) -> Event:
+        self._sequence += 1
+        event = Event(self._sequence, f"{self.epoch}-{self._sequence}", due)
+        self.history.append(event)
+        for subscriber in list(self.subscribers):
+            if not subscriber.wants(event):
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                logger.warning("Disconnecting a slow event subscriber")
+                self.dropped += 1
+                self.subscribers.discard(subscriber)
+                subscriber.close()
+        return event
+
+    def missed(self, last_event_id: str | None) -> list[Event]:
+        """Events of the history a client that last saw `last_event_id` missed."""
+        if last_event_id is None:
+            return []
+        epoch, _, sequence = last_event_id.partition("-")
+        if epoch == self.epoch and sequence.isdigit() and self.history:
+            skip = int(sequence) - self.history[0].sequence + 1
+            if skip >= 0:
+                return list(self.history)[skip:]
+        return list(self.history)
+
+    def subscribe(
+        self, last_event_id: str | None = None, telegram_id: int | None = None
+    ) -> tuple[Subscriber, list[Event]]:
+        """Register a subscriber, with the events it missed to send first."""
+        subscriber = Subscriber(self.queue_size, telegram_id)
+        missed = [
+            event for event in self.missed(last_event_id) if subscriber.wants(event)
+        ]
+        if self.closed:
+            subscriber.close()
+        else:
+            self.subscribers.add(subscriber)
+        return subscriber, missed
+
+    async def stream(
+        self, last_event_id: str | None = None, telegram_id: int | None = None
+    ) -> AsyncIterator[str]:
+        """The text/event-stream body of a subscription."""
+        subscriber, missed = self.subscribe(last_event_id, telegram_id)
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            for event in missed:
+                yield event.encode()
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        subscriber.queue.get(), self.keepalive
+                    )
+                except TimeoutError:
+                    # keeps proxies from closing the idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    return
+                yield event.encode()
+        finally:
+            self.subscribers.discard(subscriber)
+
+    async def poll(self, today: date | None = None) -> int:
+        """Publish the birthdays due `today` not published yet."""
+        today = today or date.today()
+        if today != self._today:
+            self._today, self._published = today, set()
+
+        async def due(session) -> list:
+            return (await session.execute(due_birthdays(today))).all()
+
+        published = 0
+        for row, telegram_id in await self.shards.scan(due):
+            if (telegram_id, row.birthday_id) in self._published:
+                continue
+            self._published.add((telegram_id, row.birthday_id))
+            self.publish(
+                BirthdayDueEvent(
+                    telegram_id=telegram_id,
+                    birthday_id=row.birthday_id,
+                    person_id=row.person_id,
+                    name=row.name,
+                    last_name=row.last_name,
+                    date=row.next_date,
+                    age=row.next_date.year - row.year if row.year else None,
+                )
+            )
+            published += 1
+        return published
+
+    async def run(self) -> None:
+        while True:
+            try:
+                published = await self.poll()
+                if published:
+                    logger.info(f"Published {published} birthday events")
+            except Exception as e:
+                logger.error(f"Polling due birthdays failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def close(self) -> None:
+        """End every stream, e.g. on shutdown."""
+        self.closed = True
+        for subscriber in self.subscribers:
+            subscriber.close()
+        self.subscribers.clear()
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self.subscribers),
+            "history": len(self.history),
+            "dropped": self.dropped,
+        }
+
+
+broker = EventBroker.from_settings()
+
+
+def get_broker() -> EventBroker:
+    return broker
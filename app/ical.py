@@ -0,0 +1,105 @@
+"""Rendering of birthdays as an iCalendar (RFC 5545) feed."""
+
+import logging
+from collections.abc import Iterable
+from datetime import UTC, date, datetime
+
+from sqlalchemy import Select, select
+
+from app.cache import LRUCache
+from app.config import settings
+from app.models import Birthday, Person
+
+logger = logging.getLogger(__name__)
+
+# leap year used for birthdays with unknown year, so 29 February stays valid
+_DEFAULT_YEAR = 2000
+
+# rendered feeds keyed by (telegram_id, etag); the etag embeds the user and
+# birthdays versions
+feed_cache: LRUCache[str] = LRUCache(maxsize=settings.ical_cache_size)
+
+
+def _escape(text: str) -> str:
+    return (
+        text.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\n", "\\n")
+    )
+
+
+def _fold(line: str) -> str:
+    """Fold a content line into chunks of at most 75 octets."""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line
+
+    chunks = []
+    start = 0
+    limit = 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        # never split a multi-byte UTF-8 sequence
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1
+        chunks.append(encoded[start:end].decode("utf-8"))
+        start = end
+        # continuation lines start with a space, which counts towards the limit
+        limit = 74
+    return "\r\n ".join(chunks)
+
+
+def calendar_birthdays(user_id: int) -> Select:
+    """Statement of the user's birthdays with their persons, in calendar order."""
+    return (
+        select(Birthday, Person)
+        .join(Person, Birthday.person_id == Person.id)
+        .where(Person.user_id == user_id)
+        .order_by(Birthday.month, Birthday.day, Birthday.id)
+    )
+
+
+def render_calendar(
+    birthdays: Iterable[tuple[Birthday, Person]],
+    stamp: datetime,
+    name: str = "Birthdays",
+) -> str:
+    """Render birthdays as yearly recurring all-day events."""
+    dtstamp = stamp.astimezone(UTC) if stamp.tzinfo else stamp
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//api-birthday//birthdays//EN",
+        "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:{_escape(name)}",
+    ]
+    for birthday, person in birthdays:
+        try:
+            start = date(birthday.year or _DEFAULT_YEAR, birthday.month, birthday.day)
+        except ValueError:
+            logger.warning(f"Skipping invalid date in birthday {birthday.id}")
+            continue
+
+        full_name = f"{person.name} {person.last_name}".strip()
+        # FREQ=YEARLY alone skips the non-leap years: celebrate on the last
+        # day of February, 28 February then, like the digest does
+        rrule = (
+            "RRULE:FREQ=YEARLY;BYMONTH=2;BYMONTHDAY=-1"
+            if (birthday.month, birthday.day) == (2, 29)
+            else "RRULE:FREQ=YEARLY"
+        )
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:birthday-{birthday.id}@api-birthday",
+            f"DTSTAMP:{dtstamp:%Y%m%dT%H%M%SZ}",
+            f"DTSTART;VALUE=DATE:{start:%Y%m%d}",
+            rrule,
+            f"SUMMARY:{_escape(f'Birthday of {full_name}')}",
+        ]
+        if birthday.year is not None:
+            lines.append(f"DESCRIPTION:{_escape(f'Born in {birthday.year}')}")
+        lines += ["TRANSP:TRANSPARENT", "END:VEVENT"]
+    lines.append("END:VCALENDAR")
+
+    return "".join(f"{_fold(line)}\r\n" for line in lines)
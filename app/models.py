@@ -1,16 +1,34 @@
 import logging
-from datetime import datetime
+from collections.abc import Iterable
+from datetime import UTC, datetime
+from itertools import chain
 from faker import Faker
-from pydantic import BaseModel as PydanticBaseModel
-from sqlalchemy import select
-from sqlalchemy.orm import Mapped, mapped_column
+from pydantic import BaseModel as PydanticBaseModel, Field
+from sqlalchemy import (
+    CheckConstraint,
+    ForeignKey,
+    Index,
+    Select,
+    Update,
+    event,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.orm import Mapped, Session, mapped_column
 from sqlalchemy.sql import func
 
-from app.database import Base, async_session
+from app.database import Base, shards
 
 logger = logging.getLogger(__name__)
 
 
+def utcnow() -> datetime:
+    # naive UTC, as stored in the database; unlike `func.now()` on SQLite it
+    # keeps the microseconds, so writes within a second get distinct times
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
 """
 User models
     Users are actual app users, who perform CRUD operations via the API
@@ -30,13 +48,38 @@ User models
 
 class User(Base):
     __tablename__ = "user"
+    __table_args__ = (
+        # on Postgres revalidation reads the version straight from the index;
+        # SQLite has no INCLUDE, and looks the row up
+        Index(
+            "ix_user_telegram_id",
+            "telegram_id",
+            unique=True,
+            postgresql_include=["version"],
+        ),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    telegram_id: Mapped[int] = mapped_column(unique=True, index=True, nullable=False)
+    telegram_id: Mapped[int] = mapped_column(nullable=False)
     first_name: Mapped[str] = mapped_column(nullable=False)
     last_name: Mapped[str | None] = mapped_column(default=None, nullable=True)
     username: Mapped[str | None] = mapped_column(default=None, nullable=True)
     created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(
+        default=utcnow, server_default=func.now(), onupdate=utcnow
+    )
+    # incremented by the ORM on every UPDATE, which also checks it hasn't changed
+    # since the row was loaded; writes bypassing the ORM must bump it themselves
+    version: Mapped[int] = mapped_column(nullable=False, server_default="1")
+    # bumped whenever any of the user's persons or birthdays change
+    birthdays_version: Mapped[int] = mapped_column(
+        default=0, server_default="0", nullable=False
+    )
+    birthdays_updated_at: Mapped[datetime] = mapped_column(
+        default=utcnow, server_default=func.now()
+    )
+
+    __mapper_args__ = {"version_id_col": version}
 
 
 class UserBase(PydanticBaseModel):
@@ -48,6 +91,7 @@ class UserBase(PydanticBaseModel):
 class UserPublic(UserBase):
     id: int
     created_at: datetime
+    updated_at: datetime | None = None
 
 
 class UserCreate(UserBase):
@@ -60,65 +104,179 @@ class UserUpdate(PydanticBaseModel):
     username: str | None = None
 
 
+class UserBatchUpdate(UserUpdate):
+    telegram_id: int
+
+
+class UsersBatchUpdate(PydanticBaseModel):
+    users: list[UserBatchUpdate] = Field(max_length=5000)
+
+
+class UsersBatchUpdateResult(PydanticBaseModel):
+    updated: list[int]
+    missing: list[int]
+
+
+class UsersLookup(PydanticBaseModel):
+    telegram_ids: list[int] = Field(max_length=5000)
+
+
+class UsersLookupResult(PydanticBaseModel):
+    found: dict[int, UserPublic]
+    missing: list[int]
+
+
 # utility to insert some data in the tables
 async def feed_tables_for_dev():
     logger.debug("Feeding tables ...")
-    async with async_session() as session:
-        faker = Faker()
-        # insert some users
-        for i in range(10):
-            result = (
-                (await session.execute(select(User).where(User.telegram_id == i)))
-                .scalars()
-                .first()
-            )
-            logger.debug(f"Got result: {result}")
-            if result is None:
-                u = User(
-                    telegram_id=i,
-                    first_name=faker.first_name(),
-                    last_name=faker.last_name(),
-                    username=faker.user_name(),
+    faker = Faker()
+    # insert some users, each one in its own shard
+    for index, telegram_ids in shards.group_by_shard(range(10)).items():
+        async with shards.sessionmakers[index]() as session:
+            for i in telegram_ids:
+                result = (
+                    (await session.execute(select(User).where(User.telegram_id == i)))
+                    .scalars()
+                    .first()
                 )
-                session.add(u)
-        await session.commit()
-
-
-# """
-# Person models
-#     A person is the one referred to in a specific birthday
-#     Relationship comments can be added
-# """
-#
-#
-# class Person(SQLModel, table=True):
-#     id: int | None = Field(default=None, primary_key=True)
-#     user_id: int | None = Field(default=None, foreign_key="user.id")
-#     name: str
-#     last_name: str
-#     relationship_type: str | None = Field(
-#         default=None,
-#         description="Kind of relationship, e.g. friend, mother, colleague from job #4, etc.",
-#     )
-#
-#     user: User | None = Relationship(back_populates="persons")
-#     birthdays: list["Birthday"] = Relationship(
-#         back_populates="person", cascade_delete=True
-#     )
-#
-#
-# """
-# Birthday models
-#     A birthday date is the central element in this application
-#     Note that the year of birth is optional
-# """
-#
-#
-# class Birthday(SQLModel, table=True):
-#     id: int | None = Field(default=None, primary_key=True)
-#     person_id: int | None = Field(default=None, foreign_key="person.id")
-#     day: int = Field(ge=1, le=31)
-#     month: int = Field(ge=1, le=12)
-#     year: int | None = Field(default=None, gt=1900)
-#
-#     person: Person | None = Relationship(back_populates="birthdays")
+                logger.debug(f"Got result: {result}")
+                if result is None:
+                    u = User(
+                        telegram_id=i,
+                        first_name=faker.first_name(),
+                        last_name=faker.last_name(),
+                        username=faker.user_name(),
+                    )
+                    session.add(u)
+            await session.commit()
+
+
+"""
+Person models
+    A person is the one referred to in a specific birthday
+    Relationship comments can be added
+"""
+
+
+class Person(Base):
+    __tablename__ = "person"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("user.id", ondelete="CASCADE"), index=True, nullable=False
+    )
+    name: Mapped[str] = mapped_column(nullable=False)
+    last_name: Mapped[str] = mapped_column(nullable=False)
+    relationship_type: Mapped[str | None] = mapped_column(default=None, nullable=True)
+
+
+class PersonBase(PydanticBaseModel):
+    name: str
+    last_name: str
+    relationship_type: str | None = Field(
+        default=None,
+        description="Kind of relationship, e.g. friend, mother, colleague from job #4, etc.",
+    )
+
+
+class PersonPublic(PersonBase):
+    id: int
+
+
+class PersonCreate(PersonBase):
+    pass
+
+
+"""
+Birthday models
+    A birthday date is the central element in this application
+    Note that the year of birth is optional
+"""
+
+
+class Birthday(Base):
+    __tablename__ = "birthday"
+    __table_args__ = (
+        CheckConstraint("day >= 1 AND day <= 31", name="ck_birthday_day"),
+        CheckConstraint("month >= 1 AND month <= 12", name="ck_birthday_month"),
+        CheckConstraint("year IS NULL OR year > 1900", name="ck_birthday_year"),
+        # covers the per-user aggregates of the stats, and lookups by person
+        Index("ix_birthday_person_id_month_day", "person_id", "month", "day", "year"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    person_id: Mapped[int] = mapped_column(
+        ForeignKey("person.id", ondelete="CASCADE"), nullable=False
+    )
+    day: Mapped[int] = mapped_column(nullable=False)
+    month: Mapped[int] = mapped_column(nullable=False)
+    year: Mapped[int | None] = mapped_column(default=None, nullable=True)
+
+
+class BirthdayBase(PydanticBaseModel):
+    day: int = Field(ge=1, le=31)
+    month: int = Field(ge=1, le=12)
+    year: int | None = Field(default=None, gt=1900)
+
+
+class BirthdayPublic(BirthdayBase):
+    id: int
+    person_id: int
+
+
+class BirthdayCreate(BirthdayBase):
+    pass
+
+
+def touch_birthdays(
+    user_ids: Iterable[int] = (), person_ids: Iterable[int] = ()
+) -> Update:
+    """Statement bumping the birthdays version of the given users.
+
+    Users can be given directly or through the persons they own. Writes that
+    bypass the ORM unit of work (bulk inserts, set-based deletes) must execute
+    it themselves in the same transaction.
+    """
+    return (
+        update(User)
+        .where(
+            or_(
+                User.id.in_(list(user_ids)),
+                User.id.in_(
+                    select(Person.user_id).where(Person.id.in_(list(person_ids)))
+                ),
+            )
+        )
+        .values(
+            birthdays_version=User.birthdays_version + 1,
+            birthdays_updated_at=utcnow(),
+            # the user resource itself is unchanged
+            updated_at=User.updated_at,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def user_by_telegram_id(telegram_id: int) -> Select:
+    """Statement loading the user with this `telegram_id`, the hottest lookup."""
+    return select(User).where(User.telegram_id == telegram_id)
+
+
+def user_version(telegram_id: int) -> Select:
+    """Statement reading only the id and version of a user, to revalidate it."""
+    return select(User.id, User.version).where(User.telegram_id == telegram_id)
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_birthdays_version(session: Session, flush_context) -> None:
+    """Keep `User.birthdays_version` in step with ORM writes of persons and birthdays."""
+    user_ids: set[int] = set()
+    person_ids: set[int] = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Birthday):
+            person_ids.add(obj.person_id)
+        elif isinstance(obj, Person):
+            user_ids.add(obj.user_id)
+
+    if user_ids or person_ids:
+        session.execute(touch_birthdays(user_ids, person_ids))
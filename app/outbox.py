@@ -0,0 +1,334 @@
+"""Transactional outbox for notifications.
+
+Every ORM write of users and birthdays adds a row to `outbox` in the same
+transaction, so a notification exists if and only if the change committed.
+Workers claim rows in batches, hand them to a handler and mark them done,
+retrying with exponential backoff and dead-lettering after `max_attempts`.
+Done and dead messages are purged once older than the retention period.
+
+Delivery is at-least-once: a worker crashing after the handler succeeded but
+before marking the row done lets the lease expire and the row be delivered
+again, so handlers should be idempotent on `OutboxMessage.id`.
+"""
+
+import asyncio
+import logging
+import random
+import uuid
+from collections.abc import Awaitable, Callable, Iterable
+from datetime import datetime, timedelta
+from itertools import chain
+
+from sqlalchemy import (
+    JSON,
+    Index,
+    Select,
+    and_,
+    delete,
+    event,
+    insert,
+    literal,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Mapped, Session, mapped_column
+from sqlalchemy.sql import func
+
+from app.config import settings
+from app.database import Base, Shards
+from app.models import Birthday, User, utcnow
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+DEAD = "dead"
+
+
+class OutboxMessage(Base):
+    __tablename__ = "outbox"
+    __table_args__ = (Index("ix_outbox_status_available_at", "status", "available_at"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    topic: Mapped[str] = mapped_column(nullable=False)
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False)
+    status: Mapped[str] = mapped_column(default=PENDING, nullable=False)
+    attempts: Mapped[int] = mapped_column(default=0, nullable=False)
+    available_at: Mapped[datetime] = mapped_column(default=utcnow, nullable=False)
+    claim_token: Mapped[str | None] = mapped_column(default=None, nullable=True)
+    claimed_until: Mapped[datetime | None] = mapped_column(default=None, nullable=True)
+    last_error: Mapped[str | None] = mapped_column(default=None, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+
+# messages still to deliver, a few among the finished ones kept until purged.
+# Due messages are looked up in a partial index of these, which the planner
+# only matches when the query repeats the predicate with inline values
+UNFINISHED = OutboxMessage.status.in_(
+    [literal(PENDING, literal_execute=True), literal(CLAIMED, literal_execute=True)]
+)
+Index(
+    "ix_outbox_unfinished",
+    OutboxMessage.status,
+    OutboxMessage.available_at,
+    sqlite_where=UNFINISHED,
+    postgresql_where=UNFINISHED,
+)
+
+
+def due_messages(now: datetime, max_attempts: int, limit: int) -> Select:
+    """Statement locking the ids of the next messages to deliver, oldest first."""
+    return (
+        select(OutboxMessage.id)
+        .where(
+            UNFINISHED,
+            or_(
+                and_(
+                    OutboxMessage.status == PENDING,
+                    OutboxMessage.available_at <= now,
+                ),
+                # the lease of a crashed worker expired
+                and_(
+                    OutboxMessage.status == CLAIMED,
+                    OutboxMessage.claimed_until < now,
+                    OutboxMessage.attempts < max_attempts,
+                ),
+            ),
+        )
+        .order_by(OutboxMessage.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+
+
+def enqueue(session: Session, topic: str, payloads: Iterable[dict]) -> None:
+    """Add outbox messages to the session's transaction.
+
+    Writes that bypass the ORM unit of work must call it themselves (from
+    async code, through `AsyncSession.run_sync`).
+    """
+    rows = [
+        {"topic": topic, "payload": payload, "available_at": utcnow()}
+        for payload in payloads
+    ]
+    if rows:
+        session.execute(insert(OutboxMessage), rows)
+
+
+@event.listens_for(Session, "after_flush")
+def _enqueue_on_flush(session: Session, flush_context) -> None:
+    """Record an outbox message for every ORM write of users and birthdays."""
+    messages: dict[str, list[dict]] = {}
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if not isinstance(obj, (User, Birthday)):
+            continue
+        if obj in session.new:
+            action = "created"
+        elif obj in session.deleted:
+            action = "deleted"
+        elif session.is_modified(obj):
+            action = "updated"
+        else:
+            continue
+
+        if isinstance(obj, User):
+            topic, payload = f"user.{action}", {"telegram_id": obj.telegram_id}
+        else:
+            topic = f"birthday.{action}"
+            payload = {"birthday_id": obj.id, "person_id": obj.person_id}
+        messages.setdefault(topic, []).append(payload)
+
+    for topic, payloads in messages.items():
+        enqueue(session, topic, payloads)
+
+
+Handler = Callable[[OutboxMessage], Awaitable[None]]
+
+
+async def log_message(message: OutboxMessage) -> None:
+    logger.info(f"Outbox message {message.id}: {message.topic} {message.payload}")
+
+
+class OutboxWorker:
+    """Claims batches of due outbox messages from one database and handles them.
+
+    Claiming is a single `UPDATE ... WHERE id IN (SELECT ... LIMIT n)`: on
+    Postgres the subquery uses `FOR UPDATE SKIP LOCKED` so concurrent workers
+    skip each other's rows, on SQLite the statement runs under the database
+    write lock. Either way each claim gets a unique token and a lease, and
+    any number of workers, in any number of processes, can run side by side.
+    """
+
+    def __init__(
+        self,
+        sessionmaker: async_sessionmaker[AsyncSession],
+        handler: Handler = log_message,
+        batch_size: int = 50,
+        lease: timedelta = timedelta(seconds=60),
+        max_attempts: int = 8,
+        base_backoff: float = 1.0,
+        max_backoff: float = 3600.0,
+        poll_interval: float = 1.0,
+    ):
+        self.sessionmaker = sessionmaker
+        self.handler = handler
+        self.batch_size = batch_size
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+
+    def backoff(self, attempts: int) -> timedelta:
+        """Delay before retrying a message that failed `attempts` times."""
+        delay = min(self.max_backoff, self.base_backoff * 2 ** (attempts - 1))
+        # jitter, so messages failing together don't retry together
+        return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+    async def claim(self) -> tuple[str, list[OutboxMessage]]:
+        now = utcnow()
+        token = uuid.uuid4().hex
+        due = due_messages(now, self.max_attempts, self.batch_size)
+        async with self.sessionmaker() as session:
+            messages = list(
+                await session.scalars(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id.in_(due.scalar_subquery()))
+                    .values(
+                        status=CLAIMED,
+                        claim_token=token,
+                        claimed_until=now + self.lease,
+                        attempts=OutboxMessage.attempts + 1,
+                    )
+                    .returning(OutboxMessage)
+                    .execution_options(synchronize_session=False)
+                )
+            )
+            # leases that expired too many times are dead letters
+            await session.execute(
+                update(OutboxMessage)
+                .where(
+                    UNFINISHED,
+                    OutboxMessage.status == CLAIMED,
+                    OutboxMessage.claimed_until < now,
+                    OutboxMessage.attempts >= self.max_attempts,
+                )
+                .values(status=DEAD, claim_token=None, last_error="lease expired")
+            )
+            await session.commit()
+        return token, messages
+
+    async def _finish(self, message: OutboxMessage, token: str, **values) -> None:
+        async with self.sessionmaker() as session:
+            result = await session.execute(
+                update(OutboxMessage)
+                .where(
+                    OutboxMessage.id == message.id,
+                    OutboxMessage.claim_token == token,
+                )
+                .values(claim_token=None, claimed_until=None, **values)
+            )
+            await session.commit()
+        if result.rowcount == 0:
+            logger.warning(f"Lost the lease of outbox message {message.id}")
+
+    async def process(self, message: OutboxMessage, token: str) -> None:
+        try:
+            await self.handler(message)
+        except Exception as e:
+            if message.attempts >= self.max_attempts:
+                logger.error(f"Dead-lettering outbox message {message.id}: {e}")
+                await self._finish(message, token, status=DEAD, last_error=str(e))
+            else:
+                logger.warning(f"Retrying outbox message {message.id} later: {e}")
+                await self._finish(
+                    message,
+                    token,
+                    status=PENDING,
+                    available_at=utcnow() + self.backoff(message.attempts),
+                    last_error=str(e),
+                )
+        else:
+            await self._finish(message, token, status=DONE)
+
+    async def run_once(self) -> int:
+        """Claim and handle one batch, returning the number of messages claimed."""
+        token, messages = await self.claim()
+        for message in messages:
+            await self.process(message, token)
+        return len(messages)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                claimed = await self.run_once()
+            except Exception as e:
+                logger.error(f"Outbox worker failed: {e}")
+                claimed = 0
+            if claimed == 0:
+                await asyncio.sleep(self.poll_interval)
+
+
+async def purge(
+    session: AsyncSession, retention: timedelta, batch_size: int = 10_000
+) -> int:
+    """Delete done and dead messages older than `retention`, in batches.
+
+    Batches keep each transaction, and the write lock it holds, short.
+    """
+    cutoff = utcnow() - retention
+    purged = 0
+    while True:
+        batch = (
+            select(OutboxMessage.id)
+            .where(
+                OutboxMessage.status.in_((DONE, DEAD)),
+                OutboxMessage.created_at < cutoff,
+            )
+            .limit(batch_size)
+        )
+        result = await session.execute(
+            delete(OutboxMessage).where(OutboxMessage.id.in_(batch))
+        )
+        await session.commit()
+        purged += result.rowcount
+        if result.rowcount < batch_size:
+            return purged
+
+
+async def run_purges(
+    shards: Shards, retention: timedelta, interval: float = 3600
+) -> None:
+    """Purge old done and dead messages of every shard each `interval` seconds."""
+    while True:
+        try:
+            purged = sum(await shards.fan_out(lambda s: purge(s, retention)))
+            if purged:
+                logger.info(f"Purged {purged} outbox messages")
+        except Exception as e:
+            logger.error(f"Purging the outbox failed: {e}")
+        await asyncio.sleep(interval)
+
+
+def start_workers(
+    shards: Shards, handler: Handler = log_message, concurrency: int | None = None
+) -> list[asyncio.Task]:
+    """Start `concurrency` worker tasks per shard."""
+    concurrency = settings.outbox_workers if concurrency is None else concurrency
+    logger.info(f"Starting {concurrency} outbox workers on {len(shards)} shards")
+    return [
+        asyncio.create_task(
+            OutboxWorker(
+                sessionmaker,
+                handler,
+                batch_size=settings.outbox_batch_size,
+                lease=timedelta(seconds=settings.outbox_lease_seconds),
+                max_attempts=settings.outbox_max_attempts,
+            ).run()
+        )
+        for sessionmaker in shards.sessionmakers
+        for _ in range(concurrency)
+    ]
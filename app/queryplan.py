@@ -0,0 +1,349 @@
+"""Query plans of the hottest statements, to catch them falling back to scans.
+
+Each statement of the registry names the indexes it is expected to use.
+`explain` asks the database for its plan, `EXPLAIN QUERY PLAN` on SQLite and
+`EXPLAIN (FORMAT JSON)` on Postgres, and reports which indexes it uses, which
+tables it reads in full, and how many rows each step is estimated to visit.
+Plans depend on statistics, so check them against a database seeded with
+enough rows and analyzed:
+
+    python -m app.queryplan --seed 10000
+
+exits with status 1 if a statement stops using its indexes, e.g. after a
+model or index change in `app/models.py`. Primary keys show up as
+`<table>_pkey` on every dialect.
+"""
+
+import argparse
+import asyncio
+import json
+import re
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import Connection, Executable, insert, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement
+
+from app.database import Base, shards
+from app.digest import UpcomingBirthday, next_occurrence, upcoming_birthdays
+from app.events import due_birthdays
+from app.ical import calendar_birthdays
+from app.models import Birthday, Person, User, user_by_telegram_id, user_version
+from app.outbox import DONE, PENDING, OutboxMessage, due_messages
+from app.stats import birthdays_by_day
+
+# sample parameters: plans don't depend on them, only on the statistics
+TELEGRAM_ID = 1
+USER_ID = 1
+TODAY = date(2026, 1, 1)
+NOW = datetime(2026, 1, 1)
+
+
+class Explain(Executable, ClauseElement):
+    """`EXPLAIN` prefix of any statement, binding its parameters as usual."""
+
+    inherit_cache = False
+
+    def __init__(self, statement, prefix: str):
+        self.statement = statement
+        self.prefix = prefix
+
+
+@compiles(Explain)
+def _compile_explain(element: Explain, compiler, **kw) -> str:
+    return f"{element.prefix} {compiler.process(element.statement, **kw)}"
+
+
+@dataclass(frozen=True)
+class HotQuery:
+    name: str
+    # where it runs, for the report
+    source: str
+    statement: Callable[[], Executable]
+    indexes: frozenset[str]
+
+
+# built by the same functions as at their call sites, so the check follows
+# any change of the statements
+HOT_QUERIES = [
+    HotQuery(
+        "user_by_telegram_id",
+        "crud.create_user_if_not_exists, crud.get_user",
+        lambda: user_by_telegram_id(TELEGRAM_ID),
+        frozenset({"ix_user_telegram_id"}),
+    ),
+    HotQuery(
+        "user_version",
+        "crud.get_user (If-None-Match)",
+        lambda: user_version(TELEGRAM_ID),
+        frozenset({"ix_user_telegram_id"}),
+    ),
+    HotQuery(
+        "calendar_birthdays",
+        "crud.get_birthdays_calendar",
+        lambda: calendar_birthdays(USER_ID),
+        frozenset({"ix_person_user_id", "ix_birthday_person_id_month_day"}),
+    ),
+    HotQuery(
+        "birthdays_by_day",
+        "stats.aggregate",
+        lambda: birthdays_by_day(USER_ID),
+        frozenset({"ix_person_user_id", "ix_birthday_person_id_month_day"}),
+    ),
+    HotQuery(
+        "upcoming_birthdays",
+        "crud.get_upcoming_birthdays",
+        lambda: upcoming_birthdays(USER_ID, TODAY, days=7),
+        frozenset({"upcoming_birthday_pkey"}),
+    ),
+    HotQuery(
+        "due_birthdays",
+        "events.EventBroker.poll",
+        lambda: due_birthdays(TODAY),
+        frozenset({"ix_upcoming_birthday_next_date", "user_pkey"}),
+    ),
+    HotQuery(
+        "due_messages",
+        "outbox.OutboxWorker.claim",
+        lambda: due_messages(NOW, max_attempts=5, limit=100),
+        frozenset({"ix_outbox_unfinished"}),
+    ),
+]
+
+
+@dataclass
+class PlanStep:
+    detail: str
+    table: str | None = None
+    index: str | None = None
+    # estimated rows visited, None when the database gives no estimate
+    rows: float | None = None
+
+
+@dataclass
+class QueryPlan:
+    query: HotQuery
+    steps: list[PlanStep] = field(default_factory=list)
+
+    @property
+    def indexes(self) -> set[str]:
+        return {step.index for step in self.steps if step.index}
+
+    @property
+    def full_scans(self) -> set[str]:
+        return {step.table for step in self.steps if step.table and not step.index}
+
+    @property
+    def missing(self) -> set[str]:
+        """Expected indexes the plan does not use."""
+        return set(self.query.indexes - self.indexes)
+
+    @property
+    def ok(self) -> bool:
+        return not self.missing
+
+
+# e.g. "SEARCH person USING COVERING INDEX ix_person_user_id (user_id=?)"
+_SQLITE_STEP = re.compile(
+    r"^(?:SCAN|SEARCH) (?P<table>\S+)(?: AS \S+)?"
+    r"(?: USING (?:(?:COVERING )?INDEX (?P<index>\S+)|(?P<pk>INTEGER PRIMARY KEY))"
+    r"(?: \((?P<terms>.*)\))?)?"
+)
+_SQLITE_AUTOINDEX = re.compile(r"^sqlite_autoindex_(?P<table>.+)_\d+$")
+
+
+def _sqlite_stats(conn: Connection) -> dict[str, list[float]]:
+    """`sqlite_stat1` by index, or by table for their row count, once analyzed."""
+    exists = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+    ).first()
+    if not exists:
+        return {}
+    stats = {}
+    for table, index, stat in conn.execute(
+        text("SELECT tbl, idx, stat FROM sqlite_stat1")
+    ):
+        numbers = [float(n) for n in stat.split() if n.isdigit()]
+        stats[index or table] = numbers
+        stats.setdefault(table, numbers[:1])
+    return stats
+
+
+def _sqlite_step(detail: str, stats: dict[str, list[float]]) -> PlanStep:
+    match = _SQLITE_STEP.match(detail)
+    if match is None:
+        # temp b-trees, subqueries, ...
+        return PlanStep(detail)
+    table, index = match["table"], match["index"]
+    step = PlanStep(detail, table)
+    if match["pk"]:
+        step.index, step.rows = f"{table}_pkey", 1
+        return step
+    if index is None:
+        step.rows = stats.get(table, [None])[0]
+        return step
+
+    autoindex = _SQLITE_AUTOINDEX.match(index)
+    step.index = f"{autoindex['table']}_pkey" if autoindex else index
+    numbers = stats.get(index)
+    if numbers:
+        # average rows per value of the columns compared for equality
+        terms = (match["terms"] or "").split(" AND ")
+        equal = sum(1 for term in terms if re.fullmatch(r"\w+=\?", term))
+        step.rows = numbers[min(equal, len(numbers) - 1)]
+    return step
+
+
+def _postgres_steps(node: dict) -> list[PlanStep]:
+    step = PlanStep(
+        node["Node Type"], node.get("Relation Name"), rows=node["Plan Rows"]
+    )
+    index = node.get("Index Name")
+    if index:
+        step.index = index
+    elif node["Node Type"] != "Seq Scan":
+        step.table = None
+    steps = [step]
+    for child in node.get("Plans", []):
+        steps.extend(_postgres_steps(child))
+    return steps
+
+
+def explain_sync(conn: Connection, query: HotQuery) -> QueryPlan:
+    plan = QueryPlan(query)
+    statement = query.statement()
+    if conn.dialect.name == "sqlite":
+        stats = _sqlite_stats(conn)
+        for row in conn.execute(Explain(statement, "EXPLAIN QUERY PLAN")):
+            plan.steps.append(_sqlite_step(row.detail, stats))
+    elif conn.dialect.name == "postgresql":
+        output = conn.execute(Explain(statement, "EXPLAIN (FORMAT JSON)")).scalar_one()
+        if isinstance(output, str):
+            output = json.loads(output)
+        plan.steps = _postgres_steps(output[0]["Plan"])
+    else:
+        raise ValueError(f"No query plans for {conn.dialect.name} databases")
+    return plan
+
+
+async def explain(conn: AsyncConnection, query: HotQuery) -> QueryPlan:
+    return await conn.run_sync(explain_sync, query)
+
+
+async def explain_all(engine: AsyncEngine) -> list[QueryPlan]:
+    async with engine.connect() as conn:
+        return [await explain(conn, query) for query in HOT_QUERIES]
+
+
+async def seed(engine: AsyncEngine, users: int, persons_per_user: int = 5) -> None:
+    """Fill an empty database with `users` users and their birthdays, then analyze.
+
+    Rows are inserted with Core statements, so no ORM listener runs: the
+    digest and the outbox are filled here.
+    """
+    batch = 5000
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        user_rows, person_rows, birthday_rows, digest_rows, outbox_rows = (
+            [] for _ in range(5)
+        )
+        person_id = 0
+        for user_id in range(1, users + 1):
+            user_rows.append(
+                {"id": user_id, "telegram_id": user_id, "first_name": f"User {user_id}"}
+            )
+            for _ in range(persons_per_user):
+                person_id += 1
+                day, month = person_id % 28 + 1, person_id % 12 + 1
+                person_rows.append(
+                    {
+                        "id": person_id,
+                        "user_id": user_id,
+                        "name": f"Person {person_id}",
+                        "last_name": "Doe",
+                    }
+                )
+                birthday_rows.append(
+                    {
+                        "id": person_id,
+                        "person_id": person_id,
+                        "day": day,
+                        "month": month,
+                        "year": 1950 + person_id % 60,
+                    }
+                )
+                digest_rows.append(
+                    {
+                        "user_id": user_id,
+                        "next_date": next_occurrence(day, month, TODAY),
+                        "birthday_id": person_id,
+                        "person_id": person_id,
+                        "name": f"Person {person_id}",
+                        "last_name": "Doe",
+                    }
+                )
+                # mostly delivered messages, as in a running outbox
+                outbox_rows.append(
+                    {
+                        "topic": "birthday.created",
+                        "payload": {"birthday_id": person_id},
+                        "status": DONE if person_id % 100 else PENDING,
+                        "available_at": NOW - timedelta(seconds=person_id),
+                    }
+                )
+
+        for table, rows in (
+            (User.__table__, user_rows),
+            (Person.__table__, person_rows),
+            (Birthday.__table__, birthday_rows),
+            (UpcomingBirthday.__table__, digest_rows),
+            (OutboxMessage.__table__, outbox_rows),
+        ):
+            for start in range(0, len(rows), batch):
+                await conn.execute(insert(table), rows[start : start + batch])
+        await conn.execute(text("ANALYZE"))
+
+
+def report(plans: list[QueryPlan]) -> str:
+    lines = []
+    for plan in plans:
+        status = "ok" if plan.ok else f"MISSING {', '.join(sorted(plan.missing))}"
+        lines.append(f"{plan.query.name} ({plan.query.source}): {status}")
+        for step in plan.steps:
+            rows = "?" if step.rows is None else f"{step.rows:g}"
+            lines.append(f"    {step.detail}  [~{rows} rows]")
+        if plan.full_scans:
+            lines.append(f"    full scans: {', '.join(sorted(plan.full_scans))}")
+    return "\n".join(lines)
+
+
+async def _main(users: int | None) -> list[QueryPlan]:
+    engine = shards.engines[0]
+    try:
+        if users:
+            await seed(engine, users)
+        return await explain_all(engine)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check that the hot statements use their indexes"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        metavar="USERS",
+        help="first fill the (empty) database with this many users and analyze it",
+    )
+    args = parser.parse_args()
+
+    plans = asyncio.run(_main(args.seed))
+    print(report(plans))
+    failed = [plan for plan in plans if not plan.ok]
+    print(f"{len(failed)} of {len(plans)} statements stopped using their indexes")
+    raise SystemExit(1 if failed else 0)
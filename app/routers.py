@@ -2,3 +2,5 @@ from fastapi import APIRouter
 
 
 user_router = APIRouter(prefix="/users", tags=["users"])
+stats_router = APIRouter(prefix="/stats", tags=["stats"])
+events_router = APIRouter(prefix="/events", tags=["events"])
@@ -0,0 +1,152 @@
+"""Name search over persons.
+
+SQLite uses a contentless FTS5 table kept in sync by triggers; Postgres uses a
+trigram GIN index over an unaccented expression. Both match word prefixes
+regardless of accents and case, and are scoped to a single user.
+"""
+
+import logging
+import re
+
+from sqlalchemy import DDL, event, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Person
+
+logger = logging.getLogger(__name__)
+
+# Every row also indexes an `owner` token (`u<user_id>`), so the per-user
+# filter is part of the full-text match instead of a scan over all matches.
+_SQLITE_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS person_fts USING fts5(
+        owner, name, last_name,
+        content='',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='1 2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS person_fts_insert AFTER INSERT ON person BEGIN
+        INSERT INTO person_fts(rowid, owner, name, last_name)
+        VALUES (new.id, 'u' || new.user_id, new.name, new.last_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS person_fts_delete AFTER DELETE ON person BEGIN
+        INSERT INTO person_fts(person_fts, rowid, owner, name, last_name)
+        VALUES ('delete', old.id, 'u' || old.user_id, old.name, old.last_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS person_fts_update AFTER UPDATE ON person BEGIN
+        INSERT INTO person_fts(person_fts, rowid, owner, name, last_name)
+        VALUES ('delete', old.id, 'u' || old.user_id, old.name, old.last_name);
+        INSERT INTO person_fts(rowid, owner, name, last_name)
+        VALUES (new.id, 'u' || new.user_id, new.name, new.last_name);
+    END
+    """,
+]
+
+_POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    "CREATE EXTENSION IF NOT EXISTS btree_gin",
+    # unaccent() is only STABLE, so wrap it to be usable in an index expression
+    """
+    CREATE OR REPLACE FUNCTION person_search_text(name text, last_name text)
+    RETURNS text LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+        SELECT lower(public.unaccent(
+            'public.unaccent'::regdictionary,
+            coalesce(name, '') || ' ' || coalesce(last_name, '')
+        ))
+    $$
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS ix_person_search_trgm ON person
+    USING gin (user_id, person_search_text(name, last_name) gin_trgm_ops)
+    """,
+]
+
+for dialect, statements in (("sqlite", _SQLITE_DDL), ("postgresql", _POSTGRES_DDL)):
+    for statement in statements:
+        event.listen(
+            Person.__table__,
+            "after_create",
+            DDL(statement).execute_if(dialect=dialect),
+        )
+event.listen(
+    Person.__table__,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS person_fts").execute_if(dialect="sqlite"),
+)
+
+
+def search_terms(query: str) -> list[str]:
+    """Split a free-text query into the words to prefix-match."""
+    return re.findall(r"\w+", query)
+
+
+def _fts_query(user_id: int, terms: list[str]) -> str:
+    # quoting makes every term a plain string, so user input can't inject FTS syntax
+    names = " AND ".join(f'"{term}"*' for term in terms)
+    return f"owner : u{user_id} AND {{name last_name}} : ({names})"
+
+
+async def search_persons(
+    db: AsyncSession, user_id: int, query: str, limit: int = 20
+) -> list[Person]:
+    """Persons of a user whose names start with every word in `query`, best first."""
+    terms = search_terms(query)
+    if not terms:
+        return []
+
+    if db.get_bind().dialect.name == "postgresql":
+        conditions = " AND ".join(
+            f"person_search_text(name, last_name) ~ ('\\m' || lower(unaccent(:term{i})))"
+            for i in range(len(terms))
+        )
+        stmt = text(
+            f"""
+            SELECT person.* FROM person
+            WHERE user_id = :user_id AND {conditions}
+            ORDER BY word_similarity(lower(unaccent(:query)),
+                                     person_search_text(name, last_name)) DESC, id
+            LIMIT :limit
+            """
+        ).bindparams(
+            user_id=user_id,
+            query=" ".join(terms),
+            limit=limit,
+            **{f"term{i}": term for i, term in enumerate(terms)},
+        )
+    else:
+        # name matches weigh more than last name ones
+        stmt = text(
+            """
+            SELECT person.* FROM person_fts
+            JOIN person ON person.id = person_fts.rowid
+            WHERE person_fts MATCH :match
+            ORDER BY bm25(person_fts, 0.0, 10.0, 5.0), person.id
+            LIMIT :limit
+            """
+        ).bindparams(match=_fts_query(user_id, terms), limit=limit)
+
+    return list(await db.scalars(select(Person).from_statement(stmt)))
+
+
+async def rebuild_search_index(db: AsyncSession) -> None:
+    """Re-index every person (SQLite), e.g. after restoring a database."""
+    if db.get_bind().dialect.name != "sqlite":
+        return
+    logger.info("Rebuilding person search index ...")
+    await db.execute(text("INSERT INTO person_fts(person_fts) VALUES ('delete-all')"))
+    await db.execute(
+        text(
+            """
+            INSERT INTO person_fts(rowid, owner, name, last_name)
+            SELECT id, 'u' || user_id, name, last_name FROM person
+            """
+        )
+    )
+    await db.commit()
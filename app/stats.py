@@ -0,0 +1,124 @@
+"""Birthday statistics, aggregated by the database.
+
+Birthdays are grouped by (month, day) and by age in SQL, so whatever the
+number of birthdays the queries return a few hundred rows at most, and the
+index on `birthday (person_id, month, day, year)` answers them without
+reading the table. Monthly, weekday and upcoming counts are derived from the
+(month, day) groups.
+"""
+
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+
+from pydantic import BaseModel as PydanticBaseModel
+from sqlalchemy import Select, and_, case, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.cache import LRUCache
+from app.config import settings
+from app.digest import next_occurrence
+from app.models import Birthday, Person
+
+logger = logging.getLogger(__name__)
+
+# aggregates keyed by (telegram_id, birthdays version, day), or by ("all", day,
+# time slot) for the global ones: birthday writes bump the version
+stats_cache: LRUCache["Aggregates"] = LRUCache(maxsize=settings.stats_cache_size)
+
+
+class BirthdayStats(PydanticBaseModel):
+    total: int
+    # January first
+    per_month: list[int]
+    # Monday first, on the days birthdays fall this year
+    per_weekday: list[int]
+    # age reached this year's birthday included, for birthdays with a year
+    ages: dict[int, int]
+    unknown_age: int
+    days: int
+    # birthdays in the next `days` days, today included
+    upcoming: int
+
+
+@dataclass
+class Aggregates:
+    by_day: Counter[tuple[int, int]] = field(default_factory=Counter)
+    by_age: Counter[int] = field(default_factory=Counter)
+
+    def __add__(self, other: "Aggregates") -> "Aggregates":
+        return Aggregates(self.by_day + other.by_day, self.by_age + other.by_age)
+
+
+def birthdays_by_day(user_id: int | None = None) -> Select:
+    """Statement counting birthdays, of one user or of everyone, by (month, day)."""
+    stmt = select(Birthday.month, Birthday.day, func.count()).group_by(
+        Birthday.month, Birthday.day
+    )
+    if user_id is not None:
+        stmt = stmt.join(Person, Person.id == Birthday.person_id).where(
+            Person.user_id == user_id
+        )
+    return stmt
+
+
+async def aggregate(
+    session: AsyncSession, today: date, user_id: int | None = None
+) -> Aggregates:
+    """Count birthdays, of one user or of everyone in the database, by day and age."""
+    age = (
+        today.year
+        - Birthday.year
+        # one less if this year's birthday is still to come
+        - case(
+            (
+                or_(
+                    Birthday.month > today.month,
+                    and_(Birthday.month == today.month, Birthday.day > today.day),
+                ),
+                1,
+            ),
+            else_=0,
+        )
+    ).label("age")
+
+    by_day = birthdays_by_day(user_id)
+    by_age = select(age, func.count()).where(Birthday.year.is_not(None)).group_by("age")
+    if user_id is not None:
+        by_age = by_age.join(Person, Person.id == Birthday.person_id).where(
+            Person.user_id == user_id
+        )
+
+    return Aggregates(
+        Counter({(month, day): n for month, day, n in await session.execute(by_day)}),
+        Counter(dict((await session.execute(by_age)).all())),
+    )
+
+
+def summarize(aggregates: Aggregates, today: date, days: int) -> BirthdayStats:
+    per_month = [0] * 12
+    per_weekday = [0] * 7
+    upcoming = 0
+    new_year = date(today.year, 1, 1)
+    horizon = today + timedelta(days=days)
+    for (month, day), n in aggregates.by_day.items():
+        per_month[month - 1] += n
+        this_year = next_occurrence(day, month, new_year)
+        if this_year is None:
+            continue
+        per_weekday[this_year.weekday()] += n
+        next_date = next_occurrence(day, month, today)
+        if next_date < horizon:
+            upcoming += n
+
+    total = sum(aggregates.by_day.values())
+    return BirthdayStats(
+        total=total,
+        per_month=per_month,
+        per_weekday=per_weekday,
+        ages=dict(sorted(aggregates.by_age.items())),
+        unknown_age=total - sum(aggregates.by_age.values()),
+        days=days,
+        upcoming=upcoming,
+    )
@@ -0,0 +1,179 @@
+"""Outbound Telegram Bot API client for delivering notifications.
+
+All requests share one keep-alive connection pool, and sending is throttled
+to the Bot API limits: a global rate for the whole bot plus a per-chat rate.
+Responses with status 429 are retried after the `retry_after` Telegram asks
+for. The base URL is configurable so a local stub server can stand in for
+Telegram in tests and benchmarks.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+import httpx
+
+from app.config import settings
+from app.outbox import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+# outbox topic of messages to be sent through Telegram
+MESSAGE_TOPIC = "telegram.message"
+
+
+class TelegramError(Exception):
+    def __init__(self, status_code: int, description: str):
+        super().__init__(f"Telegram API error {status_code}: {description}")
+        self.status_code = status_code
+        self.description = description
+
+
+class TokenBucket:
+    """Async token bucket allowing `rate` acquisitions per second on average.
+
+    Waiters are served in FIFO order.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Hand out no tokens for the next `seconds`."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        """Whether the bucket is full, i.e. forgetting it loses nothing."""
+        now = time.monotonic()
+        return (
+            now >= self._paused_until
+            and self._tokens + (now - self._updated) * self.rate >= self.capacity
+        )
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class TelegramSender:
+    """Rate-aware Telegram sender sharing a pool of keep-alive connections."""
+
+    # per-chat buckets kept around, idle ones are dropped beyond this
+    max_chat_buckets = 10_000
+
+    def __init__(
+        self,
+        token: str,
+        base_url: str = "https://api.telegram.org",
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        max_concurrency: int = 16,
+        max_retries: int = 3,
+        timeout: float = 10.0,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.client = httpx.AsyncClient(
+            base_url=f"{base_url.rstrip('/')}/bot{token}",
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency,
+            ),
+            timeout=timeout,
+            transport=transport,
+        )
+        self.chat_rate = chat_rate
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, capacity=global_rate)
+        self._chats: OrderedDict[int, TokenBucket] = OrderedDict()
+        self._concurrency = asyncio.Semaphore(max_concurrency)
+
+    @classmethod
+    def from_settings(cls) -> "TelegramSender":
+        if not settings.telegram_bot_token:
+            raise ValueError("TELEGRAM_BOT_TOKEN is not set")
+        return cls(
+            settings.telegram_bot_token,
+            base_url=settings.telegram_api_url,
+            global_rate=settings.telegram_global_rate,
+            chat_rate=settings.telegram_chat_rate,
+            max_concurrency=settings.telegram_max_concurrency,
+        )
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate)
+            while len(self._chats) > self.max_chat_buckets:
+                oldest_id, oldest = next(iter(self._chats.items()))
+                if not oldest.idle():
+                    break
+                del self._chats[oldest_id]
+        self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def call(self, method: str, chat_id: int, **params) -> dict:
+        """Call a Bot API `method` addressed to `chat_id`, honouring rate limits."""
+        chat_bucket = self._chat_bucket(chat_id)
+        retries = 0
+        while True:
+            # wait for the chat's turn before taking one of the shared slots
+            await chat_bucket.acquire()
+            async with self._concurrency:
+                await self._global.acquire()
+                response = await self.client.post(
+                    f"/{method}", json={"chat_id": chat_id, **params}
+                )
+
+            try:
+                data = response.json()
+            except ValueError:
+                # an error page from a proxy or load balancer, not from the API
+                raise TelegramError(response.status_code, response.text[:200]) from None
+            if response.status_code == 429 and retries < self.max_retries:
+                retries += 1
+                retry_after = data.get("parameters", {}).get("retry_after", 1)
+                logger.warning(f"Rate limited, retry in {retry_after}s")
+                # flood control applies to the whole bot, not just this chat
+                chat_bucket.pause(retry_after)
+                self._global.pause(retry_after)
+                continue
+            if not data.get("ok"):
+                raise TelegramError(response.status_code, data.get("description", ""))
+            return data["result"]
+
+    async def send_message(self, chat_id: int, text: str, **params) -> dict:
+        return await self.call("sendMessage", chat_id, text=text, **params)
+
+    async def handle_outbox_message(self, message: OutboxMessage) -> None:
+        """Outbox handler sending `telegram.message` messages."""
+        if message.topic != MESSAGE_TOPIC:
+            logger.debug(f"Ignoring outbox message {message.id}: {message.topic}")
+            return
+        await self.send_message(**message.payload)
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+    async def __aenter__(self) -> "TelegramSender":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
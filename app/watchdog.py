@@ -0,0 +1,88 @@
+"""Opt-in watchdog reporting when the asyncio event loop is blocked.
+
+A heartbeat coroutine stamps the time every `interval`; a daemon thread
+checks the stamp and, when it is older than `threshold`, captures the stack
+the loop thread is stuck in and logs it. Both only wake up a few times per
+threshold, so the watchdog is cheap enough to leave on in production.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+class LoopWatchdog:
+    def __init__(self, threshold: float = 0.1, interval: float | None = None):
+        self.threshold = threshold
+        self.interval = interval or threshold / 4
+        self.blocked_count = 0
+        self.max_blocked = 0.0
+        self.last_stack: str | None = None
+        self._beat = time.monotonic()
+        self._reported = False
+        self._loop_thread_id: int | None = None
+        self._heartbeat: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """Start watching the running event loop."""
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat = asyncio.get_running_loop().create_task(self._run_heartbeat())
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._thread.start()
+        logger.info(
+            f"Watching event loop for blocks over {self.threshold * 1000:.0f}ms"
+        )
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+        if self._thread is not None:
+            self._thread.join()
+
+    async def _run_heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            # how much later than asked for the loop got back to us
+            blocked = now - self._beat - self.interval
+            self._beat = now
+            if blocked > self.threshold:
+                self.max_blocked = max(self.max_blocked, blocked)
+                logger.warning(f"Event loop was blocked for {blocked * 1000:.0f}ms")
+            self._reported = False
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.interval):
+            blocked = time.monotonic() - self._beat - self.interval
+            if blocked <= self.threshold or self._reported:
+                continue
+            # capture while the loop is still stuck, once per block
+            self._reported = True
+            self.blocked_count += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            self.last_stack = "".join(traceback.format_stack(frame))
+            logger.warning(
+                f"Event loop blocked for over {blocked * 1000:.0f}ms in:\n"
+                f"{self.last_stack}"
+            )
+
+    def stats(self) -> dict:
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "blocked_count": self.blocked_count,
+            "max_blocked_ms": round(self.max_blocked * 1000, 1),
+        }
@@ -1,35 +1,89 @@
+import asyncio
 import logging
 import tomllib
 from contextlib import asynccontextmanager
+from datetime import timedelta
 from functools import lru_cache
 from pathlib import Path
 
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 
 from app import crud
+from app.admission import AdmissionMiddleware, admission
+from app.backup import run_backups
+from app.bloom import registered_users
 from app.config import settings
-from app.database import close_engine, create_db_and_tables
+from app.database import close_engine, create_db_and_tables, shards
+from app.digest import roll_forward_daily
+from app.events import broker
+from app.outbox import log_message, run_purges, start_workers
+from app.telegram import TelegramSender
+from app.watchdog import LoopWatchdog
 from app.logging import setup_logging
 from app.models import feed_tables_for_dev
-from app.routers import user_router
+from app.routers import events_router, stats_router, user_router
 
 # configure logger
 setup_logging(settings.log_level)
 logger = logging.getLogger(__name__)
 
+watchdog = (
+    LoopWatchdog(threshold=settings.loop_watchdog_threshold_ms / 1000)
+    if settings.loop_watchdog_threshold_ms
+    else None
+)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    if watchdog:
+        watchdog.start()
     await create_db_and_tables()
     if settings.is_dev():
         await feed_tables_for_dev()
+    await registered_users.load(shards)
+    tasks = [
+        asyncio.create_task(roll_forward_daily(shards)),
+        asyncio.create_task(admission.monitor_loop_lag()),
+        asyncio.create_task(broker.run()),
+    ]
+    sender = TelegramSender.from_settings() if settings.telegram_bot_token else None
+    if settings.backup_dir:
+        tasks.append(
+            asyncio.create_task(
+                run_backups(
+                    Path(settings.backup_dir),
+                    settings.backup_interval_hours * 3600,
+                    settings.backup_keep,
+                )
+            )
+        )
+    if settings.outbox_workers:
+        handler = sender.handle_outbox_message if sender else log_message
+        tasks += start_workers(shards, handler)
+        tasks.append(
+            asyncio.create_task(
+                run_purges(shards, timedelta(days=settings.outbox_retention_days))
+            )
+        )
     yield
+    broker.close()
+    for task in tasks:
+        task.cancel()
+    if sender:
+        await sender.aclose()
+    if watchdog:
+        watchdog.stop()
     await close_engine()
 
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(AdmissionMiddleware, controller=admission)
 
 app.include_router(user_router)
+app.include_router(stats_router)
+app.include_router(events_router)
 
 
 @lru_cache(maxsize=1)
@@ -61,6 +115,25 @@ async def root():
         "version": app_version,
         "message": message,
         "environment": settings.app_env,
+        "registrations_filter": registered_users.stats(),
         "docs": "/docs",
         "openapi": "/openapi.json",
     }
+
+
+# health checks must never touch the DB, or a slow DB gets healthy workers killed
+@app.get("/healthz")
+async def liveness():
+    """Liveness probe: the worker is up and its event loop is running."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readiness():
+    """Readiness probe: 503 while the worker is shedding load."""
+    stats = admission.stats()
+    stats["events"] = broker.stats()
+    if watchdog:
+        stats["loop_watchdog"] = watchdog.stats()
+    status_code = 503 if stats["overload"] else 200
+    return JSONResponse(stats, status_code=status_code)
@@ -1,9 +1,10 @@
 import pytest
-import pytest
+from collections.abc import Sequence
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from app.database import Base, get_db
+from app.database import Base, Shards, get_db, get_shards, set_sqlite_pragmas
+from app.models import Birthday, Person, User
 from main import app
 
 
@@ -15,16 +16,24 @@ from sqlalchemy.ext.asyncio import (
 )
 
 
-@pytest.fixture(name="session")
-async def session_fixture():
+@pytest.fixture(name="engine")
+async def engine_fixture():
     engine = create_async_engine(
         "sqlite+aiosqlite:///:memory:",
         connect_args={"check_same_thread": False},
     )
+    event.listen(engine.sync_engine, "connect", set_sqlite_pragmas)
 
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
+    yield engine
+
+    await engine.dispose()
+
+
+@pytest.fixture(name="session")
+async def session_fixture(engine):
     async_session = async_sessionmaker(
         bind=engine,
         class_=AsyncSession,
@@ -34,17 +43,63 @@ async def session_fixture():
     async with async_session() as session:
         yield session
 
-    await engine.dispose()
+
+@pytest.fixture(name="add_user")
+def add_user_fixture(session: AsyncSession):
+    """Factory of users with persons and birthdays, committed.
+
+    `persons` are (name, last_name) pairs, or how many to name "Person <i>";
+    the (day, month, year) `birthdays` are given to the persons in turn.
+    """
+
+    async def add_user(
+        telegram_id: int = 42,
+        persons: int | Sequence[tuple[str, str]] = (("Ada", "Lovelace"),),
+        birthdays: Sequence[tuple[int, int, int | None]] = (),
+        first_name: str = "Owner",
+    ) -> User:
+        if isinstance(persons, int):
+            persons = [(f"Person {i}", "Doe") for i in range(persons)]
+        user = User(telegram_id=telegram_id, first_name=first_name)
+        session.add(user)
+        await session.flush()
+        added = [
+            Person(user_id=user.id, name=name, last_name=last_name)
+            for name, last_name in persons
+        ]
+        session.add_all(added)
+        await session.flush()
+        session.add_all(
+            Birthday(
+                person_id=added[i % len(added)].id, day=day, month=month, year=year
+            )
+            for i, (day, month, year) in enumerate(birthdays)
+        )
+        await session.commit()
+        # the birthdays version was bumped behind the ORM's back
+        await session.refresh(user)
+        return user
+
+    return add_user
+
+
+@pytest.fixture(name="shards")
+def shards_fixture(engine):
+    """A single shard backed by the in-memory test database."""
+    return Shards(
+        [async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)]
+    )
 
 
 @pytest.fixture(name="client")
-def client_fixture(session: AsyncSession):
+def client_fixture(session: AsyncSession, shards: Shards):
     """Create a test client with database override."""
 
     def get_session_override():
         return session
 
     app.dependency_overrides[get_db] = get_session_override
+    app.dependency_overrides[get_shards] = lambda: shards
     client = TestClient(app)
     yield client
     app.dependency_overrides.clear()
@@ -0,0 +1,76 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.admission import AdmissionController, admission, pool_saturation
+
+
+@pytest.fixture(name="overloaded")
+def overloaded_fixture():
+    """Pretend the event loop of the app is lagging badly."""
+    admission.loop_lag = 10 * admission.max_loop_lag
+    yield admission
+    admission.loop_lag = 0.0
+
+
+@pytest.mark.anyio
+async def test_health_endpoints(client: TestClient):
+    """Test the liveness and readiness probes."""
+    assert client.get("/healthz").json() == {"status": "ok"}
+
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    assert response.json()["overload"] is None
+
+
+@pytest.mark.anyio
+async def test_overload_sheds_low_priority_routes(client: TestClient, overloaded):
+    """Test that low priority routes get a fast 503 under overload."""
+    response = client.get("/users/1/birthdays.ics")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(overloaded.retry_after)
+    assert client.get("/users/1/digest").status_code == 503
+
+    # registrations and health checks still go through
+    response = client.post("/users/", json={"telegram_id": 1, "first_name": "A"})
+    assert response.status_code == 200
+    assert client.get("/healthz").status_code == 200
+
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["shed"] >= 2
+    assert "lagging" in response.json()["overload"]
+
+
+def test_in_flight_limits():
+    """Test shedding by requests in flight."""
+    controller = AdmissionController(max_in_flight=2, engines=lambda: [])
+    assert controller.shed_reason("/users/1/digest") is None
+
+    controller.in_flight = 2
+    assert controller.shed_reason("/users/1/digest") == "too many requests in flight"
+    assert controller.shed_reason("/users/") is None
+
+    controller.in_flight = 4
+    assert controller.shed_reason("/users/") == "too many requests in flight"
+    assert controller.shed_reason("/healthz") is None
+
+
+@pytest.mark.anyio
+async def test_pool_saturation(tmp_path):
+    """Test the share of checked out connections of a queue pool."""
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}", pool_size=2, max_overflow=0
+    )
+    assert pool_saturation(engine, max_overflow=0) == 0.0
+
+    async with engine.connect():
+        assert pool_saturation(engine, max_overflow=0) == 0.5
+        controller = AdmissionController(
+            max_pool_saturation=0.5, engines=lambda: [engine], max_overflow=0
+        )
+        assert controller.overload() == "database pool saturated"
+        # overflow connections can still be opened without waiting
+        assert pool_saturation(engine, max_overflow=2) == 0.25
+
+    await engine.dispose()
@@ -1,8 +1,10 @@
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, select
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from app.database import Base, get_db
+from app.models import User
+from app.outbox import OutboxMessage
 from main import app
 
 
@@ -182,3 +184,172 @@ async def test_create_multiple_users(client: TestClient):
         response = client.post("/users/", json=user_data)
         assert response.status_code == 200
         assert "telegram_id" not in response.json()
+
+
+@pytest.mark.anyio
+async def test_lookup_users(client: TestClient):
+    """Test resolving many telegram_ids in one request."""
+    for telegram_id in (1, 2, 3):
+        client.post("/users/", json={"telegram_id": telegram_id, "first_name": "U"})
+
+    # more ids than fit in a single `IN (...)` chunk
+    telegram_ids = [3, 1, 1, *range(1000, 1600)]
+    response = client.post("/users/lookup", json={"telegram_ids": telegram_ids})
+    assert response.status_code == 200
+
+    data = response.json()
+    assert sorted(data["found"]) == ["1", "3"]
+    assert "telegram_id" not in data["found"]["1"]
+    assert data["missing"] == list(range(1000, 1600))
+
+
+@pytest.mark.anyio
+async def test_lookup_users_too_many(client: TestClient):
+    """Test that lookups are limited in size."""
+    response = client.post("/users/lookup", json={"telegram_ids": list(range(5001))})
+    assert response.status_code == 422
+
+
+@pytest.mark.anyio
+async def test_get_user_revalidation(client: TestClient):
+    """Test that an unchanged user revalidates with 304."""
+    client.post("/users/", json={"telegram_id": 10, "first_name": "Ann"})
+
+    response = client.get("/users/10")
+    assert response.status_code == 200
+    assert response.json()["first_name"] == "Ann"
+    etag = response.headers["etag"]
+
+    response = client.get("/users/10", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+
+    assert client.get("/users/11").status_code == 404
+    assert client.get("/users/11", headers={"If-None-Match": etag}).status_code == 404
+
+
+@pytest.mark.anyio
+async def test_update_user_if_match(client: TestClient):
+    """Test optimistic concurrency of user updates with If-Match."""
+    client.post("/users/", json={"telegram_id": 20, "first_name": "Ann"})
+    etag = client.get("/users/20").headers["etag"]
+
+    response = client.patch(
+        "/users/20", json={"last_name": "Lee"}, headers={"If-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.json()["first_name"] == "Ann"
+    assert response.json()["last_name"] == "Lee"
+    new_etag = response.headers["etag"]
+    assert new_etag != etag
+
+    # a client still holding the old version loses
+    response = client.patch(
+        "/users/20", json={"first_name": "Bob"}, headers={"If-Match": etag}
+    )
+    assert response.status_code == 412
+    assert client.get("/users/20").json()["first_name"] == "Ann"
+
+    # the old ETag no longer revalidates
+    assert client.get("/users/20", headers={"If-None-Match": etag}).status_code == 200
+
+    assert client.patch("/users/20", json={"first_name": None}).status_code == 422
+    assert client.patch("/users/21", json={"first_name": "X"}).status_code == 404
+
+
+@pytest.fixture(name="statements")
+def statements_fixture(engine):
+    """SQL statements executed on the test database, in order."""
+    statements: list[str] = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+
+@pytest.mark.anyio
+async def test_update_user_single_statement(client: TestClient, statements: list[str]):
+    """Test that a user update is a single UPDATE ... RETURNING."""
+    user = client.post("/users/", json={"telegram_id": 30, "first_name": "Ann"}).json()
+    etag = client.get("/users/30").headers["etag"]
+
+    statements.clear()
+    response = client.patch(
+        "/users/30", json={"username": "ann"}, headers={"If-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.json()["username"] == "ann"
+    assert response.headers["etag"] == f'"{user["id"]}-2"'
+
+    user_statements = [s for s in statements if "outbox" not in s]
+    assert len(user_statements) == 1
+    assert user_statements[0].startswith("UPDATE user SET")
+    assert "RETURNING" in user_statements[0]
+
+    # If-Match uses the strong comparison
+    response = client.patch(
+        "/users/30", json={"username": "x"}, headers={"If-Match": f"W/{etag}"}
+    )
+    assert response.status_code == 412
+    response = client.patch(
+        "/users/30", json={"username": "y"}, headers={"If-Match": "*"}
+    )
+    assert response.status_code == 200
+
+    # no fields, no write
+    statements.clear()
+    assert client.patch("/users/30", json={}).json()["username"] == "y"
+    assert not any(s.startswith("UPDATE") for s in statements)
+
+
+@pytest.mark.anyio
+async def test_update_users_batch(
+    client: TestClient, session: AsyncSession, statements: list[str]
+):
+    """Test batch updates, one executemany per set of changed fields."""
+    for telegram_id in (1, 2, 3):
+        client.post("/users/", json={"telegram_id": telegram_id, "first_name": "U"})
+
+    statements.clear()
+    response = client.patch(
+        "/users/",
+        json={
+            "users": [
+                {"telegram_id": 1, "first_name": "Ada"},
+                {"telegram_id": 2, "first_name": "Bob"},
+                {"telegram_id": 3, "username": "carl"},
+                {"telegram_id": 404, "first_name": "Nobody"},
+                {"telegram_id": 3, "last_name": "Sagan"},
+            ]
+        },
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {"updated": [1, 2, 3], "missing": [404]}
+    assert len([s for s in statements if s.startswith("UPDATE user")]) == 2
+
+    users = {
+        user.telegram_id: user
+        for user in await session.scalars(
+            select(User).execution_options(populate_existing=True)
+        )
+    }
+    assert users[1].first_name == "Ada"
+    assert users[2].first_name == "Bob"
+    assert (users[3].first_name, users[3].username, users[3].last_name) == (
+        "U",
+        "carl",
+        "Sagan",
+    )
+    assert {user.version for user in users.values()} == {2}
+
+    topics = (await session.scalars(select(OutboxMessage.topic))).all()
+    assert topics.count("user.updated") == 3
+
+    response = client.patch(
+        "/users/", json={"users": [{"telegram_id": 1, "first_name": None}]}
+    )
+    assert response.status_code == 422
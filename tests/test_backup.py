@@ -0,0 +1,115 @@
+import asyncio
+import gzip
+import sqlite3
+import pytest
+
+from app.backup import backup_database, restore_backup, snapshots, sqlite_path
+
+
+def _create_database(path, rows: int) -> None:
+    with sqlite3.connect(path) as conn:
+        # like the app's engines
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.executemany(
+            "INSERT INTO item (name) VALUES (?)", [(f"item {i}",) for i in range(rows)]
+        )
+
+
+def _count(path) -> int:
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT count(*) FROM item").fetchone()[0]
+
+
+def test_sqlite_path():
+    """Test extracting database files from URLs."""
+    assert str(sqlite_path("sqlite+aiosqlite:///data/db.sqlite")) == "data/db.sqlite"
+    assert sqlite_path("sqlite+aiosqlite://") is None
+    assert sqlite_path("sqlite:///:memory:") is None
+    assert sqlite_path("postgresql+asyncpg://u:p@host/db") is None
+
+
+@pytest.mark.anyio
+async def test_backup_and_restore(tmp_path):
+    """Test a compressed snapshot round trip."""
+    source = tmp_path / "database.db"
+    _create_database(source, rows=5000)
+
+    # tiny steps, so the copy takes many of them
+    archive = await backup_database(source, tmp_path / "backups", pages=4, pause=0)
+    assert archive.name.startswith("database-")
+    assert archive.suffixes[-2:] == [".db", ".gz"]
+    assert gzip.decompress(archive.read_bytes()).startswith(b"SQLite format 3")
+
+    with sqlite3.connect(source) as conn:
+        conn.execute("DELETE FROM item")
+    assert _count(source) == 0
+
+    restore_backup(archive, source)
+    assert _count(source) == 5000
+
+
+@pytest.mark.anyio
+async def test_backup_retention(tmp_path):
+    """Test that only the newest snapshots are kept."""
+    source = tmp_path / "database.db"
+    _create_database(source, rows=10)
+    backup_dir = tmp_path / "backups"
+
+    archives = [await backup_database(source, backup_dir, keep=2) for _ in range(3)]
+
+    assert snapshots(backup_dir, source) == archives[1:]
+
+
+@pytest.mark.anyio
+async def test_backup_retention_per_database(tmp_path):
+    """Test that databases with similar or equal file names keep their own snapshots."""
+    backup_dir = tmp_path / "backups"
+    sources = [
+        tmp_path / "shard.db",
+        tmp_path / "shard-eu.db",
+        tmp_path / "eu" / "shard.db",
+    ]
+    sources[2].parent.mkdir()
+    for source in sources:
+        _create_database(source, rows=1)
+
+    archives = {
+        source: [await backup_database(source, backup_dir, keep=1) for _ in range(2)]
+        for source in sources
+    }
+
+    for source in sources:
+        assert snapshots(backup_dir, source) == archives[source][1:]
+
+
+@pytest.mark.anyio
+async def test_backup_does_not_block_loop_or_writers(tmp_path):
+    """Test that the event loop and writers keep going during a backup."""
+    source = tmp_path / "database.db"
+    _create_database(source, rows=20_000)
+
+    writes = 0
+
+    async def write_while_backing_up(backup: asyncio.Task) -> None:
+        nonlocal writes
+        conn = sqlite3.connect(source, timeout=1)
+        while not backup.done():
+            with conn:
+                conn.execute("INSERT INTO item (name) VALUES ('new')")
+            writes += 1
+            await asyncio.sleep(0.001)
+        conn.close()
+
+    backup = asyncio.create_task(
+        backup_database(source, tmp_path / "backups", pages=2, pause=0.001)
+    )
+    # a backup restarted by every write would never finish
+    await asyncio.wait_for(write_while_backing_up(backup), timeout=10)
+    archive = await backup
+
+    assert writes > 0
+    assert _count(source) == 20_000 + writes
+    # the snapshot holds the data as of some point during the backup
+    restore_backup(archive, tmp_path / "restored.db")
+    assert 20_000 <= _count(tmp_path / "restored.db") <= 20_000 + writes
@@ -0,0 +1,78 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import crud
+from app.bloom import BloomFilter, RegistrationFilter
+from app.database import Shards
+from app.models import User
+
+
+@pytest.fixture(name="registrations")
+def registrations_fixture(monkeypatch: pytest.MonkeyPatch) -> RegistrationFilter:
+    registrations = RegistrationFilter(capacity=1000, error_rate=0.01)
+    monkeypatch.setattr(crud, "registered_users", registrations)
+    return registrations
+
+
+def test_bloom_filter_has_no_false_negatives():
+    """Test that added keys are always found and others mostly aren't."""
+    bloom = BloomFilter(capacity=10_000, error_rate=0.01)
+    for key in range(0, 20_000, 2):
+        bloom.add(key)
+
+    assert all(key in bloom for key in range(0, 20_000, 2))
+    false_positives = sum(key in bloom for key in range(1, 20_000, 2))
+    assert false_positives / 10_000 < 0.02
+
+    stats = bloom.stats()
+    assert stats["items"] == 10_000
+    assert stats["hash_count"] == 7
+    assert 0.005 < stats["estimated_error_rate"] < 0.015
+
+
+def test_bloom_filter_invalid_configuration():
+    """Test that impossible sizes are rejected."""
+    with pytest.raises(ValueError):
+        BloomFilter(capacity=0, error_rate=0.01)
+    with pytest.raises(ValueError):
+        BloomFilter(capacity=10, error_rate=1)
+
+
+@pytest.mark.anyio
+async def test_registration_filter_load(session: AsyncSession, shards: Shards):
+    """Test loading the filter from the user table."""
+    session.add_all(User(telegram_id=i, first_name="U") for i in range(100))
+    await session.commit()
+
+    registrations = RegistrationFilter(capacity=1000, error_rate=0.001)
+    assert registrations.might_exist(12345)  # unknown until loaded
+
+    await registrations.load(shards)
+    assert registrations.ready
+    assert all(registrations.might_exist(i) for i in range(100))
+    assert registrations.stats()["items"] == 100
+
+
+@pytest.mark.anyio
+async def test_create_user_with_filter(
+    client: TestClient,
+    session: AsyncSession,
+    shards: Shards,
+    registrations: RegistrationFilter,
+):
+    """Test registrations when the filter decides new users without a lookup."""
+    await registrations.load(shards)
+
+    user_data = {"telegram_id": 77, "first_name": "Ann"}
+    assert client.post("/users/", json=user_data).status_code == 200
+    assert registrations.might_exist(77)
+    assert client.post("/users/", json=user_data).status_code == 409
+
+    # a user the filter never saw still can't be registered twice
+    session.add(User(telegram_id=88, first_name="Behind the filter's back"))
+    await session.commit()
+    assert not registrations.might_exist(88)
+    response = client.post("/users/", json={"telegram_id": 88, "first_name": "Bob"})
+    assert response.status_code == 409
+    assert response.json()["detail"] == "User already exists"
@@ -0,0 +1,213 @@
+import csv
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import app.contacts
+from app.contacts import ContactsError, import_contacts, lines, parse_date, parse_vcard
+from app.digest import UpcomingBirthday
+from app.models import Birthday, Person
+from app.outbox import OutboxMessage
+
+VCARD = b"""BEGIN:VCARD\r
+VERSION:3.0\r
+N:Lovelace;Ada;;;\r
+FN:Ada Lovelace\r
+BDAY:1915-12-10\r
+END:VCARD\r
+BEGIN:VCARD\r
+VERSION:3.0\r
+FN:Grace Brewster\r
+  Hopper\r
+item1.BDAY;X-APPLE-OMIT-YEAR=1604:1604-12-09\r
+END:VCARD\r
+BEGIN:VCARD\r
+VERSION:3.0\r
+N:Nobody;No;;;\r
+END:VCARD\r
+BEGIN:VCARD\r
+N:Bad;Date;;;\r
+BDAY:1990-02-30\r
+END:VCARD\r
+"""
+
+
+async def _chunks(data: bytes, size: int = 7):
+    """Stream `data` in small chunks, splitting lines and UTF-8 sequences."""
+    for start in range(0, len(data), size):
+        yield data[start : start + size]
+
+
+async def _collect(rows) -> list:
+    return [row async for row in rows]
+
+
+@pytest.mark.anyio
+async def test_lines_across_chunks():
+    """Test decoding lines split across chunks."""
+    data = "﻿name\r\nJosé\nlast".encode()
+    assert await _collect(lines(_chunks(data, size=1))) == ["name", "José", "last"]
+
+
+@pytest.mark.anyio
+async def test_lines_with_carriage_returns(monkeypatch: pytest.MonkeyPatch):
+    """Test bare CR line endings, and the limit on the length of lines."""
+    data = b"a\rb\r\nc\r\rd\r"
+    for size in (1, 2, len(data)):
+        assert await _collect(lines(_chunks(data, size))) == ["a", "b", "c", "", "d"]
+
+    monkeypatch.setattr(app.contacts, "MAX_LINE_LENGTH", 10)
+    with pytest.raises(ContactsError):
+        await _collect(lines(_chunks(b"x" * 100, size=3)))
+
+
+def test_parse_date():
+    """Test the supported date formats."""
+    assert parse_date("1990-12-31") == (31, 12, 1990)
+    assert parse_date("19901231") == (31, 12, 1990)
+    assert parse_date("--12-31") == (31, 12, None)
+    assert parse_date("--1231") == (31, 12, None)
+    assert parse_date("1990-12-31T00:00:00Z") == (31, 12, 1990)
+    with pytest.raises(ValueError):
+        parse_date("31/12/1990")
+
+
+@pytest.mark.anyio
+async def test_parse_vcard():
+    """Test reading names and birthdays of vCards."""
+    assert await _collect(parse_vcard(_chunks(VCARD))) == [
+        (1, {"last_name": "Lovelace", "name": "Ada", "birthday": "1915-12-10"}),
+        (7, {"name": "Grace Brewster Hopper", "birthday": "--12-09"}),
+        (13, {"last_name": "Nobody", "name": "No"}),
+        (17, {"last_name": "Bad", "name": "Date", "birthday": "1990-02-30"}),
+    ]
+
+
+@pytest.mark.anyio
+async def test_import_csv(client: TestClient, session: AsyncSession, add_user):
+    """Test importing a CSV file, with duplicates and invalid rows."""
+    user = await add_user(persons=[])
+    body = (
+        "name,last_name,day,month,year\n"
+        "Ada,Lovelace,10,12,1915\n"
+        'Grace,"Hopper, Rear Admiral",9,12,\n'
+        "ada,lovelace,10,12,1915\n"
+        "Alan,Turing,32,6,1912\n"
+        "Too,Many,1,1,2000,extra\n"
+        "Leap,Day,29,2,\n"
+        "No,Birthday,,,\n"
+    )
+
+    response = client.post(
+        "/users/42/birthdays/import",
+        content=body.encode(),
+        headers={"Content-Type": "text/csv; charset=utf-8"},
+    )
+
+    assert response.status_code == 200
+    report = response.json()
+    assert report["imported"] == 3
+    assert report["duplicates"] == 1
+    assert report["without_birthday"] == 1
+    assert report["failed"] == 2
+    assert [error["line"] for error in report["errors"]] == [5, 6]
+    assert report["errors"][0]["error"].startswith("day:")
+
+    persons = (await session.scalars(select(Person).order_by(Person.id))).all()
+    assert [p.last_name for p in persons] == ["Lovelace", "Hopper, Rear Admiral", "Day"]
+    assert all(p.user_id == user.id for p in persons)
+
+    # bulk inserts still bump the version, feed the digest and the outbox
+    await session.refresh(user)
+    assert user.birthdays_version == 1
+    birthday_ids = set((await session.scalars(select(Birthday.id))).all())
+    digest_ids = set(
+        (await session.scalars(select(UpcomingBirthday.birthday_id))).all()
+    )
+    assert digest_ids == birthday_ids
+    topics = (await session.scalars(select(OutboxMessage.topic))).all()
+    assert topics.count("birthday.created") == 3
+
+    # importing the same file again adds nothing
+    response = client.post(
+        "/users/42/birthdays/import",
+        content=body.encode(),
+        headers={"Content-Type": "text/csv"},
+    )
+    assert response.json()["imported"] == 0
+    assert response.json()["duplicates"] == 4
+
+
+@pytest.mark.anyio
+async def test_import_malformed_csv_rows(client: TestClient, add_user):
+    """Test that malformed CSV rows are reported, not fatal."""
+    await add_user(persons=[])
+
+    response = client.post(
+        "/users/42/birthdays/import",
+        content=b"name,birthday\nAna,1990-01-02\nBo\rb,1991-02-03\n",
+        headers={"Content-Type": "text/csv"},
+    )
+    assert response.status_code == 200
+    assert response.json()["imported"] == 2
+    assert [error["line"] for error in response.json()["errors"]] == [3]
+
+    limit = csv.field_size_limit(20)
+    try:
+        response = client.post(
+            "/users/42/birthdays/import",
+            content=f"name,birthday\n{'x' * 30},--01-01\nCy,--03-04\n".encode(),
+            headers={"Content-Type": "text/csv"},
+        )
+    finally:
+        csv.field_size_limit(limit)
+    assert response.status_code == 200
+    assert response.json()["imported"] == 1
+    assert response.json()["errors"][0]["error"].startswith("invalid CSV:")
+
+
+@pytest.mark.anyio
+async def test_import_vcard_in_batches(session: AsyncSession, add_user):
+    """Test importing vCards in several batches."""
+    user = await add_user(persons=[])
+    cards = b"".join(
+        f"BEGIN:VCARD\nN:Person;{i}\nBDAY:--01-{i % 28 + 1:02d}\nEND:VCARD\n".encode()
+        for i in range(25)
+    )
+
+    report = await import_contacts(
+        session, user.id, parse_vcard(_chunks(cards + VCARD)), batch_size=10
+    )
+
+    assert report.imported == 27
+    assert report.without_birthday == 1
+    assert [error.line for error in report.errors] == [17 + 4 * 25]
+    assert len((await session.scalars(select(Birthday))).all()) == 27
+
+
+@pytest.mark.anyio
+async def test_import_rejected_files(client: TestClient, add_user):
+    """Test unsupported types, bad headers and unknown users."""
+    await add_user(persons=[])
+
+    response = client.post(
+        "/users/42/birthdays/import",
+        content=b"{}",
+        headers={"Content-Type": "application/json"},
+    )
+    assert response.status_code == 415
+
+    response = client.post(
+        "/users/42/birthdays/import",
+        content=b"first,last\nAda,Lovelace\n",
+        headers={"Content-Type": "text/csv"},
+    )
+    assert response.status_code == 422
+
+    response = client.post(
+        "/users/404/birthdays/import",
+        content=b"name,birthday\n",
+        headers={"Content-Type": "text/csv"},
+    )
+    assert response.status_code == 404
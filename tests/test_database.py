@@ -1,5 +1,5 @@
 import pytest
-from app.models import User
+from app.models import Birthday, Person, User
 from app.database import get_db
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -156,3 +156,86 @@ async def test_user_created_at_auto_populated(session: AsyncSession):
 
     assert user.created_at is not None
     assert isinstance(user.created_at, datetime)
+
+
+def test_shard_index_is_stable_and_in_range():
+    """Test that shard_index maps ids deterministically into [0, n)."""
+    from app.database import shard_index
+
+    indexes = [shard_index(telegram_id, 4) for telegram_id in range(1000)]
+
+    assert all(0 <= i < 4 for i in indexes)
+    assert indexes == [shard_index(telegram_id, 4) for telegram_id in range(1000)]
+    # every shard gets a share of sequential ids
+    assert set(indexes) == {0, 1, 2, 3}
+
+
+@pytest.mark.anyio
+async def test_shards_route_users_and_fan_out(tmp_path):
+    """Test that users land in their own shard and scans see all shards."""
+    from app.database import Shards
+
+    shards = Shards.from_urls(
+        [f"sqlite+aiosqlite:///{tmp_path / f'shard{i}.db'}" for i in range(3)]
+    )
+    await shards.create_all()
+
+    telegram_ids = list(range(1, 31))
+    for telegram_id in telegram_ids:
+        async with shards.session_for(telegram_id) as session:
+            session.add(User(telegram_id=telegram_id, first_name=f"User{telegram_id}"))
+            await session.commit()
+
+    async def shard_ids(session: AsyncSession) -> list[int]:
+        return list((await session.execute(select(User.telegram_id))).scalars())
+
+    per_shard = await shards.fan_out(shard_ids)
+    for index, ids in enumerate(per_shard):
+        assert all(shards.index_for(telegram_id) == index for telegram_id in ids)
+
+    assert sorted(await shards.scan(shard_ids)) == telegram_ids
+    assert (
+        sorted(
+            telegram_id
+            for ids in shards.group_by_shard(telegram_ids).values()
+            for telegram_id in ids
+        )
+        == telegram_ids
+    )
+
+    await shards.dispose()
+
+
+@pytest.mark.anyio
+async def test_user_version_incremented_on_update(session: AsyncSession):
+    """Test that every ORM update bumps the user version."""
+    user = User(telegram_id=555, first_name="Old")
+    session.add(user)
+    await session.commit()
+    await session.refresh(user)
+    assert user.version == 1
+
+    user.first_name = "New"
+    await session.commit()
+    await session.refresh(user)
+    assert user.version == 2
+    assert user.updated_at is not None
+
+
+@pytest.mark.anyio
+async def test_delete_user_cascades(session: AsyncSession):
+    """Test that deleting a user deletes their persons and birthdays."""
+    user = User(telegram_id=7, first_name="John")
+    session.add(user)
+    await session.flush()
+    person = Person(user_id=user.id, name="Jane", last_name="Doe")
+    session.add(person)
+    await session.flush()
+    session.add(Birthday(person_id=person.id, day=1, month=2))
+    await session.commit()
+
+    await session.delete(user)
+    await session.commit()
+
+    assert (await session.execute(select(Person))).first() is None
+    assert (await session.execute(select(Birthday))).first() is None
@@ -0,0 +1,92 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import app.deletion
+from app.database import Shards
+from app.deletion import purge_user
+from app.digest import UpcomingBirthday
+from app.models import Birthday, Person, User
+from app.outbox import OutboxMessage
+
+
+async def _counts(session: AsyncSession) -> dict[str, int]:
+    return {
+        model.__tablename__: await session.scalar(
+            select(func.count()).select_from(model)
+        )
+        for model in (User, Person, Birthday, UpcomingBirthday)
+    }
+
+
+@pytest.mark.anyio
+async def test_delete_user(client: TestClient, session: AsyncSession, engine, add_user):
+    """Test that a user and their rows go with a few set-based statements."""
+    await add_user(1, persons=20, birthdays=[(1, 3, None)] * 20)
+    await add_user(2, persons=2, birthdays=[(1, 3, None)] * 2)
+
+    statements: list[str] = []
+
+    def record(conn, cursor, statement, *args) -> None:
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    response = client.delete("/users/1")
+    event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+    assert response.status_code == 204
+    # one statement per table, whatever the number of persons
+    assert len([s for s in statements if s.startswith("DELETE")]) == 4
+    assert await _counts(session) == {
+        "user": 1,
+        "person": 2,
+        "birthday": 2,
+        "upcoming_birthday": 2,
+    }
+    payloads = (
+        await session.scalars(
+            select(OutboxMessage.payload).where(OutboxMessage.topic == "user.deleted")
+        )
+    ).all()
+    assert payloads == [{"telegram_id": 1}]
+
+    assert client.get("/users/1").status_code == 404
+    assert client.delete("/users/1").status_code == 404
+
+
+@pytest.mark.anyio
+async def test_purge_user_in_batches(
+    session: AsyncSession, shards: Shards, monkeypatch: pytest.MonkeyPatch, add_user
+):
+    """Test purging a user in several short transactions."""
+    monkeypatch.setattr(app.deletion, "PURGE_BATCH_SIZE", 3)
+    user = await add_user(1, persons=10, birthdays=[(1, 3, None)] * 10)
+    await add_user(2, persons=1, birthdays=[(1, 3, None)])
+
+    await purge_user(shards, telegram_id=1)
+
+    assert await _counts(session) == {
+        "user": 1,
+        "person": 1,
+        "birthday": 1,
+        "upcoming_birthday": 1,
+    }
+    assert await session.scalar(select(User).where(User.id == user.id)) is None
+    # purging a user that is gone does nothing
+    await purge_user(shards, telegram_id=1)
+
+
+@pytest.mark.anyio
+async def test_delete_user_in_background(
+    client: TestClient, session: AsyncSession, add_user
+):
+    """Test that background deletion answers 202 and purges afterwards."""
+    await add_user(1, persons=5, birthdays=[(1, 3, None)] * 5)
+
+    response = client.delete("/users/1", params={"background": True})
+
+    assert response.status_code == 202
+    # the test client runs background tasks before returning
+    assert (await _counts(session))["person"] == 0
+    assert client.get("/users/1").status_code == 404
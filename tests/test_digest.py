@@ -0,0 +1,136 @@
+import asyncio
+
+import pytest
+from datetime import date, timedelta
+from fastapi.testclient import TestClient
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import app.digest
+from app.digest import (
+    UpcomingBirthday,
+    check_digest,
+    next_occurrence,
+    roll_forward,
+    roll_forward_daily,
+)
+from app.models import Birthday, Person
+
+
+async def _digest(session: AsyncSession) -> list[UpcomingBirthday]:
+    return list(
+        await session.scalars(
+            select(UpcomingBirthday).order_by(UpcomingBirthday.next_date)
+        )
+    )
+
+
+def test_next_occurrence():
+    """Test the next celebration date of a birthday."""
+    today = date(2026, 10, 19)
+    assert next_occurrence(19, 10, today) == date(2026, 10, 19)
+    assert next_occurrence(18, 10, today) == date(2027, 10, 18)
+    assert next_occurrence(1, 12, today) == date(2026, 12, 1)
+    # 29 February falls back to the 28th in non-leap years
+    assert next_occurrence(29, 2, today) == date(2027, 2, 28)
+    assert next_occurrence(29, 2, date(2027, 3, 1)) == date(2028, 2, 29)
+    assert next_occurrence(31, 4, today) is None
+
+
+@pytest.mark.anyio
+async def test_digest_follows_birthday_writes(session: AsyncSession, add_user):
+    """Test that inserts, updates and deletes refresh the digest rows."""
+    today = date.today()
+    soon = today + timedelta(days=3)
+    await add_user(1, birthdays=[(soon.day, soon.month, 1990)])
+    person = await session.scalar(select(Person))
+    birthday = await session.scalar(select(Birthday))
+
+    rows = await _digest(session)
+    assert [(r.birthday_id, r.next_date, r.name) for r in rows] == [
+        (birthday.id, soon, "Ada")
+    ]
+
+    later = today + timedelta(days=40)
+    birthday.day, birthday.month = later.day, later.month
+    person.name = "Augusta"
+    await session.commit()
+    session.expire_all()
+
+    rows = await _digest(session)
+    assert [(r.next_date, r.name) for r in rows] == [(later, "Augusta")]
+
+    await session.delete(birthday)
+    await session.commit()
+    assert await _digest(session) == []
+
+
+@pytest.mark.anyio
+async def test_roll_forward_and_check(session: AsyncSession, add_user):
+    """Test the daily roll forward and the consistency checker."""
+    await add_user(1, birthdays=[(1, 1, None), (15, 6, None)])
+
+    assert await session.run_sync(check_digest) == []
+
+    # a year and a day later every birthday has passed
+    next_year = date.today() + timedelta(days=366)
+    assert await session.run_sync(roll_forward, next_year) == 2
+    assert await session.run_sync(check_digest, None, next_year) == []
+
+    # tamper with the table behind the incremental refresh's back
+    await session.execute(
+        update(UpcomingBirthday)
+        .values(name="Wrong")
+        .execution_options(synchronize_session=False)
+    )
+    diffs = await session.run_sync(check_digest, None, next_year, True)
+    assert len(diffs) == 2
+    assert await session.run_sync(check_digest, None, next_year) == []
+
+
+@pytest.mark.anyio
+async def test_digest_endpoint(client: TestClient, add_user):
+    """Test the upcoming birthdays endpoint."""
+    today = date.today()
+    days = [today + timedelta(days=offset) for offset in (0, 5, 20)]
+    await add_user(7, birthdays=[(day.day, day.month, 2000) for day in days])
+
+    response = client.get("/users/7/digest")
+    assert response.status_code == 200
+    data = response.json()
+    assert [item["date"] for item in data] == [
+        str(today),
+        str(today + timedelta(days=5)),
+    ]
+    assert data[0]["age"] == today.year - 2000
+
+    assert len(client.get("/users/7/digest", params={"days": 30}).json()) == 3
+    assert client.get("/users/8/digest").status_code == 404
+    assert client.get("/users/7/digest", params={"days": 0}).status_code == 422
+
+
+@pytest.mark.anyio
+async def test_roll_forward_daily_survives_errors(monkeypatch: pytest.MonkeyPatch):
+    """Test that a failed roll forward is logged and retried the next day."""
+    rolls = []
+
+    class FailingOnceShards:
+        async def fan_out(self, fn):
+            rolls.append(fn)
+            if len(rolls) == 1:
+                raise RuntimeError("database is locked")
+            return [0]
+
+    sleeps = []
+
+    async def sleep(seconds: float) -> None:
+        sleeps.append(seconds)
+        if len(sleeps) == 2:
+            raise asyncio.CancelledError
+
+    monkeypatch.setattr(app.digest.asyncio, "sleep", sleep)
+    with pytest.raises(asyncio.CancelledError):
+        await roll_forward_daily(FailingOnceShards())
+
+    assert len(rolls) == 2
+    assert all(0 < seconds <= 24 * 3600 for seconds in sleeps)
@@ -0,0 +1,122 @@
+import asyncio
+import pytest
+from datetime import date, timedelta
+from fastapi.testclient import TestClient
+
+from app.admission import AdmissionController
+from app.database import Shards
+from app.events import BirthdayDueEvent, EventBroker, get_broker
+from main import app
+
+
+def _due(birthday_id: int, telegram_id: int = 1) -> BirthdayDueEvent:
+    return BirthdayDueEvent(
+        telegram_id=telegram_id,
+        birthday_id=birthday_id,
+        person_id=1,
+        name="Ada",
+        last_name="Lovelace",
+        date=date(2026, 12, 10),
+    )
+
+
+@pytest.mark.anyio
+async def test_poll_publishes_due_birthdays_once(shards: Shards, add_user):
+    """Test that each birthday due today is published once."""
+    today = date.today()
+    await add_user(1, birthdays=[(today.day, today.month, 1990)])
+    later = today + timedelta(days=2)
+    await add_user(2, birthdays=[(later.day, later.month, 1990)])
+    broker = EventBroker(shards)
+    subscriber, _ = broker.subscribe()
+
+    assert await broker.poll(today) == 1
+    event = subscriber.queue.get_nowait()
+    assert event.event.telegram_id == 1
+    assert event.event.age == today.year - 1990
+    assert event.id == f"{broker.epoch}-1"
+
+    assert await broker.poll(today) == 0
+    await add_user(3, birthdays=[(today.day, today.month, 1990)])
+    assert await broker.poll(today) == 1
+
+
+@pytest.mark.anyio
+async def test_resume_from_last_event_id():
+    """Test replaying the events a reconnecting client missed."""
+    broker = EventBroker(shards=None, history_size=3)
+    events = [broker.publish(_due(i)) for i in range(1, 4)]
+
+    assert broker.missed(None) == []
+    assert broker.missed(events[0].id) == events[1:]
+    assert broker.missed(events[-1].id) == []
+    # ids of another process replay the whole history
+    assert broker.missed("123-1") == events
+
+    # too old for the history
+    events.append(broker.publish(_due(4)))
+    assert broker.missed(events[0].id) == events[1:]
+    assert broker.missed(f"{broker.epoch}-0") == events[1:]
+
+    _, missed = broker.subscribe(events[1].id, telegram_id=2)
+    assert missed == []
+
+
+@pytest.mark.anyio
+async def test_slow_subscriber_is_disconnected():
+    """Test that a full buffer drops its subscriber, not the others."""
+    broker = EventBroker(shards=None, queue_size=2)
+    slow, _ = broker.subscribe()
+    other, _ = broker.subscribe(telegram_id=2)
+
+    for i in range(3):
+        broker.publish(_due(i))
+
+    assert slow not in broker.subscribers
+    assert other in broker.subscribers
+    assert slow.queue.get_nowait() is None
+    assert broker.stats() == {"subscribers": 1, "history": 3, "dropped": 1}
+
+
+@pytest.mark.anyio
+async def test_stream():
+    """Test the event stream with keep-alives, until the broker closes."""
+    broker = EventBroker(shards=None, keepalive=0.01)
+    stream = broker.stream()
+
+    assert await anext(stream) == "retry: 5000\n\n"
+    assert await anext(stream) == ": keep-alive\n\n"
+    event = broker.publish(_due(1))
+    chunk = await anext(stream)
+    assert chunk.startswith(f"id: {event.id}\nevent: birthday\ndata: {{")
+    assert '"birthday_id":1' in chunk
+
+    broker.close()
+    assert await asyncio.wait_for(anext(stream, None), 1) is None
+    assert broker.subscribers == set()
+
+
+@pytest.mark.anyio
+async def test_events_endpoint(client: TestClient):
+    """Test the text/event-stream response and resumption."""
+    broker = EventBroker(shards=None)
+    broker.publish(_due(1))
+    broker.publish(_due(2))
+    # a closed broker ends streams right after the replay
+    broker.close()
+    app.dependency_overrides[get_broker] = lambda: broker
+
+    response = client.get("/events/", headers={"Last-Event-ID": f"{broker.epoch}-1"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.text.count("event: birthday") == 1
+    assert f"id: {broker.epoch}-2" in response.text
+
+
+def test_streams_admitted_like_low_priority_routes():
+    """Test that event streams are admitted like low priority routes."""
+    controller = AdmissionController(max_in_flight=1, engines=lambda: [])
+    assert controller.shed_reason("/events/") is None
+    controller.in_flight = 1
+    assert controller.shed_reason("/events/") == "too many requests in flight"
@@ -0,0 +1,148 @@
+import pytest
+from datetime import UTC, datetime, timedelta
+from fastapi.testclient import TestClient
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.conditional import etag_matches, last_modified, not_modified_since
+from app.ical import render_calendar
+from app.models import Birthday, Person, User, utcnow
+
+
+def test_render_calendar_events():
+    """Test that birthdays are rendered as yearly all-day events."""
+    person = Person(id=1, user_id=1, name="Ana", last_name="Pérez, Jr.")
+    birthdays = [
+        (Birthday(id=7, person_id=1, day=3, month=5, year=None), person),
+        (Birthday(id=8, person_id=1, day=31, month=2, year=None), person),
+    ]
+
+    body = render_calendar(birthdays, stamp=datetime(2026, 1, 2, 3, 4, 5))
+
+    assert body.startswith("BEGIN:VCALENDAR\r\n")
+    assert body.endswith("END:VCALENDAR\r\n")
+    assert "UID:birthday-7@api-birthday\r\n" in body
+    assert "DTSTART;VALUE=DATE:20000503\r\n" in body
+    assert "RRULE:FREQ=YEARLY\r\n" in body
+    assert "SUMMARY:Birthday of Ana Pérez\\, Jr.\r\n" in body
+    assert "DTSTAMP:20260102T030405Z\r\n" in body
+    # 31 February cannot be rendered
+    assert "birthday-8" not in body
+
+
+def test_render_calendar_leap_day():
+    """Test that 29 February recurs on the last day of February."""
+    person = Person(id=1, user_id=1, name="Ana", last_name="Pérez")
+    body = render_calendar(
+        [(Birthday(id=1, person_id=1, day=29, month=2, year=1992), person)],
+        stamp=datetime(2026, 1, 1),
+    )
+
+    assert "DTSTART;VALUE=DATE:19920229\r\n" in body
+    assert "RRULE:FREQ=YEARLY;BYMONTH=2;BYMONTHDAY=-1\r\n" in body
+
+
+def test_render_calendar_folds_long_lines():
+    """Test that content lines are folded at 75 octets."""
+    person = Person(id=1, user_id=1, name="Ñ" * 60, last_name="Long")
+    body = render_calendar(
+        [(Birthday(id=1, person_id=1, day=1, month=1), person)],
+        stamp=datetime(2026, 1, 1),
+    )
+
+    for line in body.split("\r\n"):
+        assert len(line.encode("utf-8")) <= 75
+    assert "Ñ" * 60 in body.replace("\r\n ", "")
+
+
+def test_conditional_helpers():
+    """Test ETag and If-Modified-Since comparisons."""
+    assert etag_matches('"a", W/"1-2"', '"1-2"')
+    assert not etag_matches('W/"1-2"', '"1-2"', weak=False)
+    assert etag_matches("*", '"1-2"')
+    assert not etag_matches(None, '"1-2"')
+
+    modified = datetime(2026, 10, 19, 10, 0, 0, 500000)
+    assert not_modified_since("Mon, 19 Oct 2026 10:00:01 GMT", modified)
+    # modified within the second named
+    assert not not_modified_since("Mon, 19 Oct 2026 10:00:00 GMT", modified)
+    assert not not_modified_since("not a date", modified)
+
+    # the end of the second, once it is over
+    now = datetime(2026, 10, 19, 10, 0, 0, 900000, tzinfo=UTC)
+    assert last_modified(modified, now) == datetime(2026, 10, 19, 10, 0, 0, tzinfo=UTC)
+    now = datetime(2026, 10, 19, 10, 0, 1, tzinfo=UTC)
+    assert last_modified(modified, now) == datetime(2026, 10, 19, 10, 0, 1, tzinfo=UTC)
+
+
+@pytest.mark.anyio
+async def test_calendar_feed_revalidation(
+    client: TestClient, session: AsyncSession, add_user
+):
+    """Test that unchanged feeds return 304 and changes produce a new ETag."""
+    user = await add_user(
+        42,
+        first_name="John",
+        persons=[("Maria", "Núñez")],
+        birthdays=[(29, 2, 1992)],
+    )
+    assert user.birthdays_version == 2  # one person and one birthday written
+
+    response = client.get("/users/42/birthdays.ics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/calendar")
+    assert "DTSTART;VALUE=DATE:19920229" in response.text
+    etag = response.headers["etag"]
+
+    response = client.get("/users/42/birthdays.ics", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+
+    # a write within the second of the previous response is not missed
+    response = client.get("/users/42/birthdays.ics")
+    session.add(Birthday(person_id=1, day=2, month=6))
+    await session.commit()
+    response = client.get(
+        "/users/42/birthdays.ics",
+        headers={"If-Modified-Since": response.headers["last-modified"]},
+    )
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    # modified a while ago: Last-Modified names the end of that second
+    past = utcnow() - timedelta(minutes=5)
+    await session.execute(
+        update(User).values(updated_at=past, birthdays_updated_at=past)
+    )
+    await session.commit()
+    response = client.get("/users/42/birthdays.ics")
+    response = client.get(
+        "/users/42/birthdays.ics",
+        headers={"If-Modified-Since": response.headers["last-modified"]},
+    )
+    assert response.status_code == 304
+
+    birthday = Birthday(person_id=1, day=1, month=6)
+    session.add(birthday)
+    await session.commit()
+
+    response = client.get("/users/42/birthdays.ics", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert "DTSTART;VALUE=DATE:20000601" in response.text
+    etag = response.headers["etag"]
+
+    # the user's name is in the feed
+    response = client.patch("/users/42", json={"first_name": "Renamed"})
+    assert response.status_code == 200
+    response = client.get("/users/42/birthdays.ics", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert "X-WR-CALNAME:Birthdays of Renamed" in response.text
+
+
+@pytest.mark.anyio
+async def test_calendar_feed_unknown_user(client: TestClient):
+    """Test that the feed of an unknown user is 404."""
+    response = client.get("/users/404/birthdays.ics")
+    assert response.status_code == 404
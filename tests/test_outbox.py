@@ -0,0 +1,179 @@
+import asyncio
+import pytest
+from datetime import timedelta
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.database import Base
+from app.models import Birthday, Person, User
+from app.outbox import (
+    DEAD,
+    DONE,
+    PENDING,
+    OutboxMessage,
+    OutboxWorker,
+    purge,
+    utcnow,
+)
+
+
+def _sessionmaker(session: AsyncSession) -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(
+        bind=session.bind, class_=AsyncSession, expire_on_commit=False
+    )
+
+
+async def _messages(session: AsyncSession) -> list[OutboxMessage]:
+    session.expire_all()
+    return list(await session.scalars(select(OutboxMessage).order_by(OutboxMessage.id)))
+
+
+@pytest.mark.anyio
+async def test_writes_enqueue_messages_in_same_transaction(session: AsyncSession):
+    """Test that ORM writes add outbox rows that commit and roll back with them."""
+    user = User(telegram_id=1, first_name="Ann")
+    session.add(user)
+    await session.flush()
+    person = Person(user_id=user.id, name="Bob", last_name="Lee")
+    session.add(person)
+    await session.flush()
+    session.add(Birthday(person_id=person.id, day=1, month=2))
+    await session.commit()
+
+    assert [(m.topic, m.status) for m in await _messages(session)] == [
+        ("user.created", PENDING),
+        ("birthday.created", PENDING),
+    ]
+    assert (await _messages(session))[0].payload == {"telegram_id": 1}
+
+    session.add(User(telegram_id=2, first_name="Rolled back"))
+    await session.flush()
+    await session.rollback()
+    assert len(await _messages(session)) == 2
+
+
+@pytest.mark.anyio
+async def test_worker_delivers_messages(session: AsyncSession):
+    """Test that a worker hands claimed messages to the handler once."""
+    session.add_all(User(telegram_id=i, first_name="U") for i in range(5))
+    await session.commit()
+
+    delivered = []
+
+    async def handler(message: OutboxMessage) -> None:
+        delivered.append(message.payload["telegram_id"])
+
+    worker = OutboxWorker(_sessionmaker(session), handler, batch_size=3)
+    assert await worker.run_once() == 3
+    assert await worker.run_once() == 2
+    assert await worker.run_once() == 0
+
+    assert sorted(delivered) == list(range(5))
+    assert {m.status for m in await _messages(session)} == {DONE}
+
+
+@pytest.mark.anyio
+async def test_worker_retries_then_dead_letters(session: AsyncSession):
+    """Test retries with backoff and dead-lettering of failing messages."""
+    session.add(User(telegram_id=1, first_name="U"))
+    await session.commit()
+
+    async def handler(message: OutboxMessage) -> None:
+        raise RuntimeError("boom")
+
+    worker = OutboxWorker(
+        _sessionmaker(session), handler, max_attempts=2, base_backoff=3600
+    )
+    assert await worker.run_once() == 1
+    [message] = await _messages(session)
+    assert message.status == PENDING
+    assert message.attempts == 1
+    assert message.last_error == "boom"
+    assert message.available_at > utcnow() + timedelta(minutes=29)
+
+    # not due yet
+    assert await worker.run_once() == 0
+
+    await session.execute(update(OutboxMessage).values(available_at=utcnow()))
+    await session.commit()
+    assert await worker.run_once() == 1
+    [message] = await _messages(session)
+    assert message.status == DEAD
+    assert message.attempts == 2
+
+
+@pytest.mark.anyio
+async def test_expired_lease_is_reclaimed(session: AsyncSession):
+    """Test that messages of a crashed worker are retried after the lease."""
+    session.add(User(telegram_id=1, first_name="U"))
+    await session.commit()
+
+    crashed = OutboxWorker(_sessionmaker(session), lease=timedelta(seconds=-1))
+    token, messages = await crashed.claim()
+    assert len(messages) == 1
+
+    delivered = []
+
+    async def handler(message: OutboxMessage) -> None:
+        delivered.append(message.id)
+
+    worker = OutboxWorker(_sessionmaker(session), handler)
+    assert await worker.run_once() == 1
+    assert delivered == [messages[0].id]
+
+    # the crashed worker can no longer complete its claim
+    await crashed.process(messages[0], token)
+    [message] = await _messages(session)
+    assert message.status == DONE
+    assert message.attempts == 2
+
+
+@pytest.mark.anyio
+async def test_concurrent_workers_claim_disjoint_batches(tmp_path):
+    """Test that concurrent workers never deliver a message twice."""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'outbox.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+
+    async with sessionmaker() as session:
+        session.add_all(User(telegram_id=i, first_name="U") for i in range(200))
+        await session.commit()
+
+    delivered = []
+
+    async def handler(message: OutboxMessage) -> None:
+        delivered.append(message.id)
+        await asyncio.sleep(0)
+
+    workers = [OutboxWorker(sessionmaker, handler, batch_size=7) for _ in range(4)]
+
+    async def drain(worker: OutboxWorker) -> None:
+        while await worker.run_once():
+            pass
+
+    await asyncio.gather(*(drain(worker) for worker in workers))
+
+    assert len(delivered) == 200
+    assert len(set(delivered)) == 200
+    await engine.dispose()
+
+
+@pytest.mark.anyio
+async def test_purge_old_finished_messages(session: AsyncSession):
+    """Test that only old done and dead messages are purged."""
+    old = utcnow() - timedelta(days=30)
+    for status in (DONE, DEAD, PENDING):
+        session.add_all(
+            [
+                OutboxMessage(topic="t", payload={}, status=status, created_at=old),
+                OutboxMessage(topic="t", payload={}, status=status),
+            ]
+        )
+    await session.commit()
+
+    assert await purge(session, timedelta(days=7), batch_size=1) == 2
+
+    remaining = await _messages(session)
+    assert len(remaining) == 4
+    assert all(m.status == PENDING or m.created_at > old for m in remaining)
@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import text
+
+from app.queryplan import (
+    HOT_QUERIES,
+    _sqlite_step,
+    explain_all,
+    explain_sync,
+    report,
+    seed,
+)
+
+
+def test_sqlite_step():
+    """Test reading tables, indexes and row estimates off SQLite plans."""
+    stats = {"user": [1000.0], "ix_person_user_id": [5000.0, 5.0]}
+
+    step = _sqlite_step(
+        "SEARCH person USING COVERING INDEX ix_person_user_id (user_id=?)", stats
+    )
+    assert (step.table, step.index, step.rows) == ("person", "ix_person_user_id", 5)
+    step = _sqlite_step("SEARCH user USING INTEGER PRIMARY KEY (rowid=?)", stats)
+    assert (step.index, step.rows) == ("user_pkey", 1)
+    step = _sqlite_step(
+        "SEARCH upcoming_birthday USING INDEX sqlite_autoindex_upcoming_birthday_1 "
+        "(user_id=? AND next_date>?)",
+        stats,
+    )
+    assert step.index == "upcoming_birthday_pkey"
+    step = _sqlite_step("SCAN user", stats)
+    assert (step.table, step.index, step.rows) == ("user", None, 1000)
+    assert _sqlite_step("USE TEMP B-TREE FOR ORDER BY", stats).table is None
+
+
+@pytest.mark.anyio
+async def test_hot_queries_use_their_indexes(engine):
+    """Test that every hot statement uses its indexes on a seeded database."""
+    await seed(engine, users=2000)
+
+    plans = await explain_all(engine)
+
+    assert [plan.query.name for plan in plans] == [q.name for q in HOT_QUERIES]
+    assert all(plan.ok for plan in plans), report(plans)
+    assert not any(plan.full_scans for plan in plans), report(plans)
+    by_name = {plan.query.name: plan for plan in plans}
+    # estimates from the statistics gathered by ANALYZE
+    assert by_name["user_by_telegram_id"].steps[0].rows == 1
+    assert by_name["calendar_birthdays"].steps[0].rows == 5
+
+
+@pytest.mark.anyio
+async def test_dropped_index_is_reported(engine):
+    """Test that a statement losing its index fails the check."""
+    await seed(engine, users=500)
+    async with engine.begin() as conn:
+        await conn.execute(text("DROP INDEX ix_person_user_id"))
+        await conn.execute(text("ANALYZE"))
+
+    plans = {plan.query.name: plan for plan in await explain_all(engine)}
+
+    assert not plans["calendar_birthdays"].ok
+    assert plans["calendar_birthdays"].missing == {"ix_person_user_id"}
+    assert "MISSING ix_person_user_id" in report(list(plans.values()))
+    assert plans["user_by_telegram_id"].ok
+
+
+def test_unsupported_dialect():
+    """Test that dialects without a plan reader are rejected."""
+    conn = SimpleNamespace(dialect=SimpleNamespace(name="mysql"))
+    with pytest.raises(ValueError):
+        explain_sync(conn, HOT_QUERIES[0])
@@ -0,0 +1,65 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Person
+from app.search import rebuild_search_index, search_persons, search_terms
+
+
+def test_search_terms():
+    """Test that FTS syntax in queries is reduced to plain words."""
+    assert search_terms('mar "OR* lo-pe') == ["mar", "OR", "lo", "pe"]
+    assert search_terms(" *() ") == []
+
+
+@pytest.mark.anyio
+async def test_search_prefix_accents_and_scope(session: AsyncSession, add_user):
+    """Test accent-insensitive prefix matching scoped to one user."""
+    user = await add_user(
+        1,
+        [("María", "López"), ("Mario", "Rossi"), ("Ana", "Marín"), ("Bob", "Smith")],
+    )
+    await add_user(2, [("Marta", "Other")])
+
+    names = [p.name for p in await search_persons(session, user.id, "mar")]
+    # first name matches rank before last name ones
+    assert set(names[:2]) == {"María", "Mario"}
+    assert names[2:] == ["Ana"]
+
+    result = await search_persons(session, user.id, "MARIA lop")
+    assert [(p.name, p.last_name) for p in result] == [("María", "López")]
+
+    assert await search_persons(session, user.id, "smi") != []
+    assert await search_persons(session, user.id, "zzz") == []
+
+
+@pytest.mark.anyio
+async def test_search_index_follows_writes(session: AsyncSession, add_user):
+    """Test that updates and deletes of persons are reflected in the index."""
+    user = await add_user(1, [("Carla", "Gómez")])
+
+    await session.execute(update(Person).values(name="Daniela"))
+    await session.commit()
+    assert await search_persons(session, user.id, "carl") == []
+    assert len(await search_persons(session, user.id, "dan")) == 1
+
+    await rebuild_search_index(session)
+    assert len(await search_persons(session, user.id, "gomez")) == 1
+
+    await session.execute(delete(Person))
+    await session.commit()
+    assert await search_persons(session, user.id, "dan") == []
+
+
+@pytest.mark.anyio
+async def test_search_endpoint(client: TestClient, add_user):
+    """Test the person search endpoint."""
+    await add_user(5, [("Éric", "Martin")])
+
+    response = client.get("/users/5/persons/search", params={"q": "eri"})
+    assert response.status_code == 200
+    assert [p["name"] for p in response.json()] == ["Éric"]
+
+    assert client.get("/users/6/persons/search", params={"q": "eri"}).status_code == 404
+    assert client.get("/users/5/persons/search", params={"q": ""}).status_code == 422
@@ -0,0 +1,86 @@
+import pytest
+from datetime import date
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Birthday, Person
+from app.stats import aggregate, stats_cache, summarize
+
+
+@pytest.mark.anyio
+async def test_aggregate_and_summarize(session: AsyncSession, add_user):
+    """Test the histograms computed from grouped counts."""
+    user = await add_user(
+        1,
+        birthdays=[
+            (19, 10, 1990),  # today: 36 years old
+            (20, 10, 1990),  # tomorrow: still 35
+            (20, 10, None),
+            (29, 2, 2000),  # 28 February 2026, a Saturday
+            (1, 1, 2025),
+        ],
+    )
+    await add_user(2, birthdays=[(5, 5, None)])
+    today = date(2026, 10, 19)
+
+    aggregates = await aggregate(session, today, user.id)
+    assert aggregates.by_day[(10, 20)] == 2
+    assert dict(aggregates.by_age) == {36: 1, 35: 1, 26: 1, 1: 1}
+
+    stats = summarize(aggregates, today, days=2)
+    assert stats.total == 5
+    assert stats.per_month == [1, 1, 0, 0, 0, 0, 0, 0, 0, 3, 0, 0]
+    # Monday 19, Tuesday 20 October, Saturday 28 February, Thursday 1 January
+    assert stats.per_weekday == [1, 2, 0, 1, 0, 1, 0]
+    assert stats.ages == {1: 1, 26: 1, 35: 1, 36: 1}
+    assert stats.unknown_age == 1
+    assert stats.upcoming == 3
+    assert summarize(aggregates, today, days=1).upcoming == 1
+
+    everyone = await aggregate(session, today)
+    assert summarize(everyone, today, days=366).total == 6
+
+
+@pytest.mark.anyio
+async def test_user_stats_invalidated_on_writes(
+    client: TestClient, session: AsyncSession, add_user
+):
+    """Test that cached stats are recomputed after a birthday is written."""
+    stats_cache.clear()
+    user = await add_user(42, birthdays=[(1, 6, None)])
+
+    response = client.get("/users/42/stats")
+    assert response.status_code == 200
+    assert response.json()["total"] == 1
+    assert response.json()["per_month"][5] == 1
+
+    hits = stats_cache.hits
+    assert client.get("/users/42/stats", params={"days": 366}).json()["upcoming"] == 1
+    assert stats_cache.hits == hits + 1
+
+    person = Person(user_id=user.id, name="Grace", last_name="Hopper")
+    session.add(person)
+    await session.flush()
+    session.add(Birthday(person_id=person.id, day=9, month=12, year=1906))
+    await session.commit()
+
+    response = client.get("/users/42/stats")
+    assert response.json()["total"] == 2
+    assert response.json()["per_month"][11] == 1
+
+    assert client.get("/users/404/stats").status_code == 404
+    assert client.get("/users/42/stats", params={"days": 0}).status_code == 422
+
+
+@pytest.mark.anyio
+async def test_global_stats(client: TestClient, add_user):
+    """Test the stats across every user."""
+    stats_cache.clear()
+    await add_user(1, birthdays=[(1, 6, None)])
+    await add_user(2, birthdays=[(2, 6, 1990)])
+
+    response = client.get("/stats/")
+    assert response.status_code == 200
+    assert response.json()["total"] == 2
+    assert response.json()["per_month"][5] == 2
+    assert response.json()["unknown_age"] == 1
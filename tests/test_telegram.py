@@ -0,0 +1,179 @@
+import asyncio
+import json
+import time
+import httpx
+import pytest
+
+from app.outbox import OutboxMessage
+from app.telegram import TelegramError, TelegramSender, TokenBucket
+
+
+class StubTelegram:
+    """Stand-in for the Bot API, recording the messages it receives."""
+
+    def __init__(self, rate_limited: int = 0):
+        self.rate_limited = rate_limited
+        self.sent: list[dict] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.001)
+        self.in_flight -= 1
+
+        body = json.loads(request.content)
+        if self.rate_limited:
+            self.rate_limited -= 1
+            return httpx.Response(
+                429,
+                json={
+                    "ok": False,
+                    "description": "Too Many Requests: retry after 0",
+                    "parameters": {"retry_after": 0},
+                },
+            )
+        if body["chat_id"] < 0:
+            return httpx.Response(
+                400, json={"ok": False, "description": "Bad Request: chat not found"}
+            )
+        self.sent.append({"path": request.url.path, **body})
+        return httpx.Response(200, json={"ok": True, "result": {"message_id": 1}})
+
+
+def _sender(stub: StubTelegram, **kwargs) -> TelegramSender:
+    return TelegramSender(
+        "TOKEN",
+        base_url="http://telegram.test",
+        transport=httpx.MockTransport(stub),
+        **kwargs,
+    )
+
+
+@pytest.mark.anyio
+async def test_token_bucket_rate():
+    """Test that a token bucket spaces acquisitions by its rate."""
+    bucket = TokenBucket(rate=100, capacity=1)
+    start = time.monotonic()
+    for _ in range(6):
+        await bucket.acquire()
+    assert time.monotonic() - start >= 0.045
+
+
+@pytest.mark.anyio
+async def test_send_message():
+    """Test sending a message through the Bot API."""
+    stub = StubTelegram()
+    async with _sender(stub) as sender:
+        assert await sender.send_message(42, "Hi") == {"message_id": 1}
+
+    assert stub.sent == [{"path": "/botTOKEN/sendMessage", "chat_id": 42, "text": "Hi"}]
+
+
+@pytest.mark.anyio
+async def test_send_message_retries_after_429():
+    """Test that rate-limited requests are retried after `retry_after`."""
+    stub = StubTelegram(rate_limited=2)
+    async with _sender(stub, chat_rate=1000) as sender:
+        await sender.send_message(42, "Hi")
+    assert len(stub.sent) == 1
+
+    stub = StubTelegram(rate_limited=5)
+    async with _sender(stub, chat_rate=1000, max_retries=1) as sender:
+        with pytest.raises(TelegramError) as exc_info:
+            await sender.send_message(42, "Hi")
+    assert exc_info.value.status_code == 429
+
+
+@pytest.mark.anyio
+async def test_429_pauses_every_chat():
+    """Test that flood control from one chat holds back the other chats too."""
+    sent_at: dict[int, float] = {}
+    limited = False
+
+    async def flood_control(request: httpx.Request) -> httpx.Response:
+        nonlocal limited
+        chat_id = json.loads(request.content)["chat_id"]
+        if not limited:
+            limited = True
+            return httpx.Response(
+                429,
+                json={"ok": False, "parameters": {"retry_after": 0.2}},
+            )
+        sent_at[chat_id] = time.monotonic()
+        return httpx.Response(200, json={"ok": True, "result": {}})
+
+    sender = TelegramSender(
+        "TOKEN",
+        base_url="http://telegram.test",
+        transport=httpx.MockTransport(flood_control),
+    )
+    async with sender:
+        start = time.monotonic()
+        first = asyncio.create_task(sender.send_message(1, "Hi"))
+        await asyncio.sleep(0.05)
+        await sender.send_message(2, "Hi")
+        await first
+
+    assert sent_at[1] - start >= 0.2
+    assert sent_at[2] - start >= 0.2
+
+
+@pytest.mark.anyio
+async def test_send_message_error():
+    """Test that API and non-JSON errors are raised as TelegramError."""
+    async with _sender(StubTelegram()) as sender:
+        with pytest.raises(TelegramError, match="chat not found"):
+            await sender.send_message(-1, "Hi")
+
+    async def bad_gateway(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(502, text="<html>502 Bad Gateway</html>")
+
+    sender = TelegramSender(
+        "TOKEN",
+        base_url="http://telegram.test",
+        transport=httpx.MockTransport(bad_gateway),
+    )
+    async with sender:
+        with pytest.raises(TelegramError, match="Bad Gateway") as exc_info:
+            await sender.send_message(42, "Hi")
+    assert exc_info.value.status_code == 502
+
+
+@pytest.mark.anyio
+async def test_concurrency_and_chat_rate_are_bounded():
+    """Test bounded concurrency and per-chat throttling."""
+    stub = StubTelegram()
+    async with _sender(stub, max_concurrency=4, chat_rate=50) as sender:
+        start = time.monotonic()
+        await asyncio.gather(
+            *(sender.send_message(chat_id, "Hi") for chat_id in range(40)),
+            *(sender.send_message(1000, f"#{i}") for i in range(4)),
+        )
+        elapsed = time.monotonic() - start
+
+    assert len(stub.sent) == 44
+    assert stub.max_in_flight <= 4
+    # four messages to one chat at 50/s take at least 3 intervals
+    assert elapsed >= 0.06
+    assert [m["text"] for m in stub.sent if m["chat_id"] == 1000] == [
+        f"#{i}" for i in range(4)
+    ]
+
+
+@pytest.mark.anyio
+async def test_handle_outbox_message():
+    """Test that only `telegram.message` outbox messages are sent."""
+    stub = StubTelegram()
+    async with _sender(stub) as sender:
+        await sender.handle_outbox_message(
+            OutboxMessage(
+                id=1, topic="telegram.message", payload={"chat_id": 7, "text": "Hey"}
+            )
+        )
+        await sender.handle_outbox_message(
+            OutboxMessage(id=2, topic="user.created", payload={"telegram_id": 7})
+        )
+
+    assert [m["text"] for m in stub.sent] == ["Hey"]
@@ -0,0 +1,44 @@
+import asyncio
+import logging
+import time
+import pytest
+
+from app.watchdog import LoopWatchdog
+
+
+def _block_the_loop(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+@pytest.mark.anyio
+async def test_watchdog_captures_blocking_stack(caplog: pytest.LogCaptureFixture):
+    """Test that a blocked loop is reported once, with the blocking stack."""
+    watchdog = LoopWatchdog(threshold=0.05)
+    watchdog.start()
+    try:
+        with caplog.at_level(logging.WARNING, logger="app.watchdog"):
+            await asyncio.sleep(0.05)
+            _block_the_loop(0.3)
+            await asyncio.sleep(0.05)
+    finally:
+        watchdog.stop()
+
+    assert watchdog.blocked_count == 1
+    assert "_block_the_loop" in watchdog.last_stack
+    assert watchdog.stats()["max_blocked_ms"] >= 200
+    assert any("_block_the_loop" in record.message for record in caplog.records)
+
+
+@pytest.mark.anyio
+async def test_watchdog_quiet_when_loop_is_free():
+    """Test that cooperative code is not reported."""
+    watchdog = LoopWatchdog(threshold=0.05)
+    watchdog.start()
+    try:
+        for _ in range(10):
+            await asyncio.sleep(0.01)
+    finally:
+        watchdog.stop()
+
+    assert watchdog.blocked_count == 0
+    assert watchdog.last_stack is None